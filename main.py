@@ -22,30 +22,54 @@ Supported option styles:
   • bullet   * star   - dash   – en-dash
 """
 
+import bisect
+import functools
+import gzip
+import hashlib
+import json
+import multiprocessing
 import os
 import re
 import sqlite3
 import tempfile
+import threading
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Annotated, Optional
 
+import anyio
+import orjson
 import pdfplumber
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
-from fastapi.responses import HTMLResponse, JSONResponse
+from pdfplumber.display import PageImage
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import (
+    FileResponse, HTMLResponse, JSONResponse, ORJSONResponse, Response,
+)
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from starlette.datastructures import Headers
+from pydantic import BaseModel, StringConstraints
 
 from auth import (
-    hash_password, verify_password, create_access_token,
+    AuthUser, ahash_password, averify_password, needs_rehash, create_access_token,
     get_current_user, get_optional_user,
 )
+from pdf_extract import (
+    PNG_COMPRESS_LEVEL, VLine, extract_page, extract_page_range,
+)
 
 # ──────────────────────────────────────────────
 # App setup
 # ──────────────────────────────────────────────
 
-app = FastAPI(title="PDF to Mock Test")
+# orjson serialises the dict/list payloads returned by the API routes;
+# errors and explicit JSONResponse returns are unaffected.
+app = FastAPI(title="PDF to Mock Test", default_response_class=ORJSONResponse)
 
 BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
@@ -56,15 +80,99 @@ os.makedirs(IMAGES_DIR, exist_ok=True)
 
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
+# gzip for API JSON, the HTML pages and test.js.  Level 4 gets most of level
+# 9's saving on this repetitive JSON at a fraction of the CPU.  Extracted
+# question images are already-compressed PNG/JPEG and bypass it.
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL    = 4
+
+
+def _accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """True if an Accept-Encoding header allows gzip (q-values honoured).
+
+    An explicit gzip / x-gzip entry decides; otherwise a "*" entry does.
+    """
+    wildcard = None
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            wildcard = q > 0
+    return bool(wildcard)
+
+
+class _GZipMiddleware(GZipMiddleware):
+    # Starlette's own check is a substring test ("gzip;q=0" would match), so
+    # the negotiation is done here and the base class only compresses.
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and (
+            scope["path"].startswith("/static/images/")
+            or not _accepts_gzip(Headers(scope=scope).get("accept-encoding"))
+        ):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(_GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
+
 
 # ──────────────────────────────────────────────
 # Database helpers
 # ──────────────────────────────────────────────
 
+# One connection per thread, opened on first use and then kept: the event-loop
+# thread (async routes) and each worker thread (sync routes) reuse theirs, so a
+# request calling several db_* helpers pays the connect + PRAGMA cost once.
+# sqlite3 connections must stay on the thread that created them, hence
+# threading.local rather than a shared pool.
+_db_local = threading.local()
+
+# Per-connection settings.  journal_mode=WAL is persistent in the database
+# file and is set once in init_auth_db; synchronous=NORMAL is only safe (no
+# corruption, at worst the last commits lost on power failure) in WAL mode.
+# Every worker thread keeps its own connection, so the private page cache is
+# paid up to THREADPOOL_SIZE times; the mmap view is backed by the shared OS
+# page cache and does not multiply the same way.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 268435456",   # 256 MiB
+    "PRAGMA cache_size = -4000",      # ~4 MB page cache per connection
+)
+
+_STATEMENT_CACHE_SIZE = 256
+
+
 def get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = ON")
+    """Return this thread's connection.
+
+    Use as ``with get_connection() as conn:`` – leaving the block commits (or
+    rolls back on error) but does not close the connection.
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        # sqlite3 keeps an LRU of prepared statements per connection, keyed by
+        # the SQL text.  Because the connection now lives as long as its
+        # thread, the literal SQL in each db_* helper is parsed once and then
+        # re-bound; the size just needs to exceed the number of distinct
+        # statements in this module so none are evicted.
+        conn = sqlite3.connect(DB_PATH, cached_statements=_STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        _db_local.conn = conn
     return conn
 
 
@@ -93,11 +201,17 @@ def init_db():
             )
             """
         )
+        # Index-only scans for scoring / breakdown queries, which read just
+        # (id, correct_option) and would otherwise load the wide text rows.
+        conn.execute("CREATE INDEX idx_q_correct ON questions(id, correct_option)")
         conn.commit()
 
 
 def insert_questions(questions: list[dict]):
     with get_connection() as conn:
+        # Take the write lock up front so the whole batch is one transaction
+        # (one journal sync) and cannot hit SQLITE_BUSY half-way through.
+        conn.execute("BEGIN IMMEDIATE")
         conn.executemany(
             """
             INSERT INTO questions
@@ -112,6 +226,158 @@ def insert_questions(questions: list[dict]):
             questions,
         )
         conn.commit()
+    _bump_questions_version()
+
+
+# ── /api/questions snapshot ───────────────────────────────────────────────────
+# The serialised question list only changes when insert_questions replaces the
+# set, so it is built once per version and served as bytes.  The version lives
+# in this worker process; other workers re-read the table at least every
+# _QUESTIONS_CACHE_TTL seconds.  The ETag is a hash of the body, so it is the
+# same in every worker for the same question set.  The gzip encoding is
+# compressed once per snapshot too, rather than by the middleware per request.
+_QUESTIONS_CACHE_TTL = 30.0
+_questions_version = 0
+
+
+@dataclass(slots=True)
+class _QuestionsSnapshot:
+    version:  int
+    built_at: float
+    etag:     str
+    body:     bytes
+    gz_etag:  str
+    gz_body:  bytes
+
+
+_questions_cache: Optional[_QuestionsSnapshot] = None
+
+
+def _bump_questions_version() -> None:
+    global _questions_version
+    _questions_version += 1
+
+
+def _questions_snapshot() -> _QuestionsSnapshot:
+    """Return the serialised snapshot of the current question set."""
+    global _questions_cache
+    version = _questions_version
+    now = time.monotonic()
+    cached = _questions_cache
+    if (cached is not None and cached.version == version
+            and now - cached.built_at < _QUESTIONS_CACHE_TTL):
+        return cached
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT id, question, option_a, option_b, option_c, option_d, "
+            "option_a_image, option_b_image, option_c_image, option_d_image, "
+            "has_diagram, image_path, question_image FROM questions ORDER BY id"
+        ).fetchall()
+    # Rows go straight to orjson (dict() per Row via default=), skipping
+    # the intermediate list of dicts.
+    body = orjson.dumps(rows, default=dict)
+    digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+    # Stored under the version read *before* the query: an insert that
+    # commits meanwhile bumps the version, so this entry is simply a miss.
+    snap = _questions_cache = _QuestionsSnapshot(
+        version  = version,
+        built_at = now,
+        etag     = f'"{digest}"',
+        body     = body,
+        gz_etag  = f'"{digest}-gz"',
+        gz_body  = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+    )
+    return snap
+
+
+def _etag_matches(if_none_match: Optional[str], *etags: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") in etags
+        for tag in if_none_match.split(",")
+    )
+
+
+# Idempotent DDL for init_auth_db, run as one executescript() call in a single
+# transaction.  Column additions and the user_answers CHECK migration need
+# per-statement error handling / inspection and stay separate below.
+_AUTH_DDL_SCRIPT = """
+    -- WAL: readers no longer block on writers and each commit needs a single
+    -- fsync.  Creates questions.db-wal / questions.db-shm alongside the database.
+    PRAGMA journal_mode = WAL;
+
+    BEGIN;
+
+    CREATE TABLE IF NOT EXISTS users (
+        id            INTEGER PRIMARY KEY AUTOINCREMENT,
+        email         TEXT    NOT NULL UNIQUE,
+        username      TEXT    NOT NULL,
+        password_hash TEXT    NOT NULL,
+        created_at    TEXT    NOT NULL DEFAULT (datetime('now'))
+    );
+
+    CREATE TABLE IF NOT EXISTS test_attempts (
+        id              INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id         INTEGER NOT NULL REFERENCES users(id),
+        pdf_name        TEXT    NOT NULL,
+        total_questions INTEGER NOT NULL DEFAULT 0,
+        duration        INTEGER NOT NULL DEFAULT 60,
+        status          TEXT    NOT NULL DEFAULT 'ongoing',
+        score           REAL,
+        started_at      TEXT    NOT NULL DEFAULT (datetime('now')),
+        completed_at    TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_attempt_user ON test_attempts(user_id);
+    -- api_start_attempt's "ongoing attempt for this user + PDF" probe: an
+    -- equality seek on all three columns, newest first via the implicit rowid.
+    CREATE INDEX IF NOT EXISTS idx_attempt_user_pdf_status
+        ON test_attempts(user_id, pdf_name, status);
+
+    -- Scoring configuration, with exactly one default row
+    CREATE TABLE IF NOT EXISTS scoring_config (
+        id            INTEGER PRIMARY KEY,
+        marks_correct INTEGER NOT NULL DEFAULT 4,
+        marks_wrong   INTEGER NOT NULL DEFAULT -1
+    );
+    INSERT INTO scoring_config (id, marks_correct, marks_wrong)
+    SELECT 1, 4, -1
+    WHERE NOT EXISTS (SELECT 1 FROM scoring_config WHERE id = 1);
+
+    -- Per-question time spent
+    CREATE TABLE IF NOT EXISTS question_time_spent (
+        id          INTEGER PRIMARY KEY AUTOINCREMENT,
+        attempt_id  INTEGER NOT NULL REFERENCES test_attempts(id),
+        question_id INTEGER NOT NULL,
+        seconds     INTEGER NOT NULL DEFAULT 0,
+        UNIQUE(attempt_id, question_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_qtime_attempt ON question_time_spent(attempt_id);
+
+    -- Parsed-PDF cache (keyed by content hash), trimmed to the
+    -- PDF_CACHE_MAX_ENTRIES most recently used rows
+    CREATE TABLE IF NOT EXISTS pdf_cache (
+        hash        TEXT PRIMARY KEY,
+        parsed_json TEXT NOT NULL,
+        created_at  TEXT NOT NULL DEFAULT (datetime('now')),
+        last_used   TEXT
+    );
+
+    COMMIT;
+"""
+
+# Columns added after the first release (idempotent: "duplicate column" is ignored).
+_AUTH_COLUMN_MIGRATIONS = (
+    "ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE test_attempts ADD COLUMN correct INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE test_attempts ADD COLUMN wrong INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE test_attempts ADD COLUMN unanswered INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE test_attempts ADD COLUMN total_time INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE test_attempts ADD COLUMN results_json TEXT",
+    "ALTER TABLE pdf_cache ADD COLUMN last_used TEXT",
+)
 
 
 def init_auth_db():
@@ -134,41 +400,14 @@ def init_auth_db():
     """
 
     with get_connection() as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                id            INTEGER PRIMARY KEY AUTOINCREMENT,
-                email         TEXT    NOT NULL UNIQUE,
-                username      TEXT    NOT NULL,
-                password_hash TEXT    NOT NULL,
-                created_at    TEXT    NOT NULL DEFAULT (datetime('now'))
-            )
-            """
-        )
+        conn.executescript(_AUTH_DDL_SCRIPT)
 
-        # ── Migrate: add is_admin column if missing (idempotent) ──────────────
-        try:
-            conn.execute(
-                "ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0"
-            )
-        except sqlite3.OperationalError:
-            pass  # column already exists
-
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS test_attempts (
-                id              INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id         INTEGER NOT NULL REFERENCES users(id),
-                pdf_name        TEXT    NOT NULL,
-                total_questions INTEGER NOT NULL DEFAULT 0,
-                duration        INTEGER NOT NULL DEFAULT 60,
-                status          TEXT    NOT NULL DEFAULT 'ongoing',
-                score           REAL,
-                started_at      TEXT    NOT NULL DEFAULT (datetime('now')),
-                completed_at    TEXT
-            )
-            """
-        )
+        # ── Migrate: add columns missing from older databases ─────────────────
+        for ddl in _AUTH_COLUMN_MIGRATIONS:
+            try:
+                conn.execute(ddl)
+            except sqlite3.OperationalError:
+                pass  # column already exists
 
         # ── user_answers: create fresh or migrate to add CHECK constraint ──────
         # Detect whether the CHECK exists by reading the stored DDL directly.
@@ -198,70 +437,30 @@ def init_auth_db():
                 )
                 conn.execute("DROP TABLE user_answers_old")
 
-        # ── Indexes (idempotent) ───────────────────────────────────────────────
+        # Covers the scoring JOIN (attempt_id → question_id, chosen_key) without
+        # touching the table.  It also makes the old single-column
+        # idx_answer_attempt redundant, as does the UNIQUE(attempt_id,
+        # question_id) autoindex.
         conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_attempt_user "
-            "ON test_attempts(user_id)"
-        )
-        conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_answer_attempt "
-            "ON user_answers(attempt_id)"
+            "CREATE INDEX IF NOT EXISTS idx_answer_attempt_cover "
+            "ON user_answers(attempt_id, question_id, chosen_key)"
         )
+        conn.execute("DROP INDEX IF EXISTS idx_answer_attempt")
 
-        # ── Scoring configuration table ────────────────────────────────────────
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS scoring_config (
-                id            INTEGER PRIMARY KEY,
-                marks_correct INTEGER NOT NULL DEFAULT 4,
-                marks_wrong   INTEGER NOT NULL DEFAULT -1
-            )
-            """
-        )
-        # Ensure exactly one default row exists
-        conn.execute(
-            """
-            INSERT INTO scoring_config (id, marks_correct, marks_wrong)
-            SELECT 1, 4, -1
-            WHERE NOT EXISTS (SELECT 1 FROM scoring_config WHERE id = 1)
-            """
-        )
+        conn.commit()
 
-        # ── Migrate: add summary columns to test_attempts (idempotent) ─────────
-        for _col, _default in [
-            ("correct",    "0"),
-            ("wrong",      "0"),
-            ("unanswered", "0"),
-            ("total_time", "0"),
-        ]:
-            try:
-                conn.execute(
-                    f"ALTER TABLE test_attempts ADD COLUMN {_col} INTEGER NOT NULL DEFAULT {_default}"
-                )
-            except sqlite3.OperationalError:
-                pass  # column already exists
 
-        # ── Per-question time spent ────────────────────────────────────────────
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS question_time_spent (
-                id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                attempt_id  INTEGER NOT NULL REFERENCES test_attempts(id),
-                question_id INTEGER NOT NULL,
-                seconds     INTEGER NOT NULL DEFAULT 0,
-                UNIQUE(attempt_id, question_id)
-            )
-            """
-        )
-        conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_qtime_attempt "
-            "ON question_time_spent(attempt_id)"
-        )
+# ── User helpers ──────────────────────────────────────────────────────────────
 
-        conn.commit()
+def _tuple_cursor(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """Cursor returning plain tuples, for hot helpers that build their own dicts.
 
+    Skips constructing a sqlite3.Row per row only to copy it into a dict.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+    return cur
 
-# ── User helpers ──────────────────────────────────────────────────────────────
 
 def db_create_user(email: str, username: str, password_hash: str) -> int:
     with get_connection() as conn:
@@ -275,19 +474,33 @@ def db_create_user(email: str, username: str, password_hash: str) -> int:
 
 def db_get_user_by_email(email: str) -> Optional[dict]:
     with get_connection() as conn:
-        row = conn.execute(
+        row = _tuple_cursor(conn).execute(
             "SELECT id, email, username, password_hash, is_admin FROM users WHERE email = ?",
             (email,),
         ).fetchone()
-    return dict(row) if row else None
+    if not row:
+        return None
+    return {"id": row[0], "email": row[1], "username": row[2],
+            "password_hash": row[3], "is_admin": row[4]}
+
+
+def db_update_password_hash(user_id: int, password_hash: str) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ?",
+            (password_hash, user_id),
+        )
+        conn.commit()
 
 
 def db_get_user_by_id(user_id: int) -> Optional[dict]:
     with get_connection() as conn:
-        row = conn.execute(
+        row = _tuple_cursor(conn).execute(
             "SELECT id, email, username, is_admin FROM users WHERE id = ?", (user_id,)
         ).fetchone()
-    return dict(row) if row else None
+    if not row:
+        return None
+    return {"id": row[0], "email": row[1], "username": row[2], "is_admin": row[3]}
 
 
 # ── Attempt helpers ───────────────────────────────────────────────────────────
@@ -311,10 +524,18 @@ def db_get_attempt(attempt_id: int) -> Optional[dict]:
     return dict(row) if row else None
 
 
+# Every test_attempts column except the results_json snapshot, in table order.
+_ATTEMPT_LIST_COLUMNS = (
+    "id, user_id, pdf_name, total_questions, duration, status, score, "
+    "started_at, completed_at, correct, wrong, unanswered, total_time"
+)
+
+
 def db_get_user_attempts(user_id: int) -> list[dict]:
     with get_connection() as conn:
         rows = conn.execute(
-            "SELECT * FROM test_attempts WHERE user_id = ? ORDER BY id DESC",
+            f"SELECT {_ATTEMPT_LIST_COLUMNS} FROM test_attempts "
+            "WHERE user_id = ? ORDER BY id DESC",
             (user_id,),
         ).fetchall()
     return [dict(r) for r in rows]
@@ -333,13 +554,46 @@ def db_upsert_answer(attempt_id: int, question_id: int, chosen_key: str):
         conn.commit()
 
 
+# Exclusive bound of SQLite's signed 64-bit INTEGER; larger Python ints fail to bind.
+_SQLITE_INT_LIMIT = 1 << 63
+
+# Option keys accepted as an answer or as a question's correct_option.
+_VALID_KEYS = frozenset("abcd")
+
+
+def db_upsert_answers(
+    attempt_id: int,
+    answers: list[tuple[int, str]],
+    conn: Optional[sqlite3.Connection] = None,
+) -> None:
+    """Bulk db_upsert_answer: [(question_id, chosen_key), …] in one transaction.
+
+    Pass `conn` to run inside a transaction the caller already holds.
+    """
+    if not answers:
+        return
+    if conn is None:
+        with get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")  # one write transaction for all rows
+            db_upsert_answers(attempt_id, answers, conn)
+        return
+    conn.executemany(
+        """INSERT INTO user_answers (attempt_id, question_id, chosen_key)
+           VALUES (?,?,?)
+           ON CONFLICT(attempt_id, question_id) DO UPDATE SET
+               chosen_key  = excluded.chosen_key,
+               answered_at = datetime('now')""",
+        [(attempt_id, qid, key) for qid, key in answers],
+    )
+
+
 def db_get_attempt_answers(attempt_id: int) -> list[dict]:
     with get_connection() as conn:
-        rows = conn.execute(
+        rows = _tuple_cursor(conn).execute(
             "SELECT question_id, chosen_key FROM user_answers WHERE attempt_id = ?",
             (attempt_id,),
         ).fetchall()
-    return [dict(r) for r in rows]
+    return [{"question_id": qid, "chosen_key": key} for qid, key in rows]
 
 
 def db_complete_attempt(
@@ -349,24 +603,35 @@ def db_complete_attempt(
     wrong: int,
     unanswered: int,
     total_time: int,
+    results_json: str | None = None,
+    conn: Optional[sqlite3.Connection] = None,
 ):
-    with get_connection() as conn:
-        conn.execute(
-            """UPDATE test_attempts
-               SET status       = 'completed',
-                   score        = ?,
-                   correct      = ?,
-                   wrong        = ?,
-                   unanswered   = ?,
-                   total_time   = ?,
-                   completed_at = datetime('now')
-               WHERE id = ?""",
-            (score, correct, wrong, unanswered, total_time, attempt_id),
-        )
-        conn.commit()
+    if conn is None:
+        with get_connection() as conn:
+            return db_complete_attempt(
+                attempt_id, score, correct, wrong, unanswered, total_time,
+                results_json, conn,
+            )
+    conn.execute(
+        """UPDATE test_attempts
+           SET status       = 'completed',
+               score        = ?,
+               correct      = ?,
+               wrong        = ?,
+               unanswered   = ?,
+               total_time   = ?,
+               results_json = ?,
+               completed_at = datetime('now')
+           WHERE id = ?""",
+        (score, correct, wrong, unanswered, total_time, results_json, attempt_id),
+    )
 
 
-def db_save_time_spent(attempt_id: int, time_spent: dict) -> None:
+def db_save_time_spent(
+    attempt_id: int,
+    time_spent: dict,
+    conn: Optional[sqlite3.Connection] = None,
+) -> None:
     """Bulk-upsert per-question time (seconds) for an attempt."""
     rows = []
     for qid, secs in time_spent.items():
@@ -376,25 +641,110 @@ def db_save_time_spent(attempt_id: int, time_spent: dict) -> None:
             pass  # skip any malformed entries
     if not rows:
         return
-    with get_connection() as conn:
-        conn.executemany(
-            """INSERT INTO question_time_spent (attempt_id, question_id, seconds)
-               VALUES (?,?,?)
-               ON CONFLICT(attempt_id, question_id) DO UPDATE SET
-                   seconds = excluded.seconds""",
-            rows,
-        )
-        conn.commit()
+    if conn is None:
+        with get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")  # one write transaction for all rows
+            _save_time_spent_rows(conn, rows)
+        return
+    _save_time_spent_rows(conn, rows)
 
 
-def db_get_time_spent(attempt_id: int) -> dict:
-    """Return {str(question_id): seconds} for an attempt."""
-    with get_connection() as conn:
-        rows = conn.execute(
-            "SELECT question_id, seconds FROM question_time_spent WHERE attempt_id = ?",
-            (attempt_id,),
-        ).fetchall()
-    return {str(r["question_id"]): r["seconds"] for r in rows}
+def _save_time_spent_rows(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    conn.executemany(
+        """INSERT INTO question_time_spent (attempt_id, question_id, seconds)
+           VALUES (?,?,?)
+           ON CONFLICT(attempt_id, question_id) DO UPDATE SET
+               seconds = excluded.seconds""",
+        rows,
+    )
+
+
+def db_get_breakdown(
+    attempt_id: int,
+    time_spent: dict,
+    conn: Optional[sqlite3.Connection] = None,
+) -> list[dict]:
+    """One result entry per question (correct / wrong / unanswered + time)."""
+    if conn is None:
+        with get_connection() as conn:
+            return db_get_breakdown(attempt_id, time_spent, conn)
+    # All questions in display order (id == display order after init_db),
+    # each with this attempt's answer if any – one pass, the answer side
+    # a point lookup on the UNIQUE(attempt_id, question_id) index.
+    rows = _tuple_cursor(conn).execute(
+        """SELECT    q.id, q.correct_option, ua.chosen_key
+           FROM      questions q
+           LEFT JOIN user_answers ua
+                  ON ua.attempt_id = ? AND ua.question_id = q.id
+           ORDER BY  q.id""",
+        (attempt_id,),
+    ).fetchall()
+
+    breakdown = []
+    for num, (qid, correct, chosen) in enumerate(rows, start=1):
+        if chosen is None:
+            status = "unanswered"
+        elif chosen == correct:
+            status = "correct"
+        else:
+            status = "wrong"
+
+        breakdown.append({
+            "question_num":   num,
+            "question_id":    qid,
+            "chosen_key":     chosen,
+            "correct_option": correct,
+            "time_seconds":   time_spent.get(str(qid), 0),
+            "status":         status,
+        })
+    return breakdown
+
+
+def db_get_time_spent(
+    attempt_id: int,
+    conn: Optional[sqlite3.Connection] = None,
+) -> dict:
+    """Return {str(question_id): seconds} for an attempt.
+
+    The object is built by SQLite's json_group_object, so one row (a JSON
+    string) is fetched instead of one Row per question.
+    """
+    if conn is None:
+        with get_connection() as conn:
+            return db_get_time_spent(attempt_id, conn)
+    row = conn.execute(
+        """SELECT json_group_object(CAST(question_id AS TEXT), seconds)
+           FROM   question_time_spent
+           WHERE  attempt_id = ?""",
+        (attempt_id,),
+    ).fetchone()
+    return json.loads(row[0])
+
+
+def _count_answers(
+    attempt_id: int,
+    conn: Optional[sqlite3.Connection] = None,
+) -> tuple[int, int]:
+    """Return (correct, answered) for an attempt, aggregated inside SQLite.
+
+    Only answers to questions that still exist are counted (inner JOIN).
+    chosen_key and correct_option are both NOT NULL, so every answered row
+    that is not correct is wrong.
+    """
+    if conn is None:
+        with get_connection() as conn:
+            return _count_answers(attempt_id, conn)
+    row = conn.execute(
+        """
+        SELECT COALESCE(SUM(ua.chosen_key = q.correct_option), 0),
+               COUNT(*)
+        FROM   user_answers ua
+        JOIN   questions    q  ON q.id = ua.question_id
+        WHERE  ua.attempt_id = ?
+        """,
+        (attempt_id,),
+    ).fetchone()
+    return row[0], row[1]
 
 
 def calculate_score(attempt_id: int) -> float:
@@ -414,26 +764,14 @@ def calculate_score(attempt_id: int) -> float:
     marks_correct = float(config["marks_correct"])
     marks_wrong   = float(config["marks_wrong"])
 
-    with get_connection() as conn:
-        rows = conn.execute(
-            """
-            SELECT ua.chosen_key, q.correct_option
-            FROM   user_answers ua
-            JOIN   questions    q  ON q.id = ua.question_id
-            WHERE  ua.attempt_id = ?
-            """,
-            (attempt_id,),
-        ).fetchall()
-    score = 0.0
-    for row in rows:
-        if row["chosen_key"] == row["correct_option"]:
-            score += marks_correct
-        else:
-            score += marks_wrong
-    return score
+    correct, answered = _count_answers(attempt_id)
+    return correct * marks_correct + (answered - correct) * marks_wrong
 
 
-def calculate_score_detailed(attempt_id: int) -> dict:
+def calculate_score_detailed(
+    attempt_id: int,
+    conn: Optional[sqlite3.Connection] = None,
+) -> dict:
     """Server-side scoring with full breakdown.
 
     Reads answers from user_answers, compares against questions.correct_option.
@@ -450,26 +788,21 @@ def calculate_score_detailed(attempt_id: int) -> dict:
             "wrong":      int,
             "unanswered": int,
         }
+
+    Pass `conn` to read inside a transaction the caller already holds.
     """
     config        = db_get_scoring_config()
     marks_correct = float(config["marks_correct"])
     marks_wrong   = float(config["marks_wrong"])
 
-    with get_connection() as conn:
-        total_questions = conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
-        rows = conn.execute(
-            """
-            SELECT ua.chosen_key, q.correct_option
-            FROM   user_answers ua
-            JOIN   questions    q  ON q.id = ua.question_id
-            WHERE  ua.attempt_id = ?
-            """,
-            (attempt_id,),
-        ).fetchall()
+    if conn is None:
+        with get_connection() as conn:
+            return calculate_score_detailed(attempt_id, conn)
+    total_questions = conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+    correct, answered = _count_answers(attempt_id, conn)
 
-    correct   = sum(1 for r in rows if r["chosen_key"] == r["correct_option"])
-    wrong     = sum(1 for r in rows if r["chosen_key"] != r["correct_option"])
-    unanswered = total_questions - len(rows)
+    wrong      = answered - correct
+    unanswered = total_questions - answered
 
     raw_score = correct * marks_correct + wrong * marks_wrong
     score     = max(0.0, raw_score)          # floor at zero
@@ -484,13 +817,27 @@ def calculate_score_detailed(attempt_id: int) -> dict:
 
 # ── Scoring config helpers ────────────────────────────────────────────────────
 
+# Scoring marks change only on an admin action, so they are cached per worker
+# process.  db_update_scoring_config invalidates this worker's copy at once;
+# other workers pick the change up within _SCORING_CACHE_TTL seconds.
+_SCORING_CACHE_TTL = 30.0
+_SCORING_CACHE: dict = {"v": None, "t": 0.0}
+
+
 def db_get_scoring_config() -> dict:
     """Return the single scoring_config row, falling back to defaults."""
-    with get_connection() as conn:
-        row = conn.execute(
-            "SELECT marks_correct, marks_wrong FROM scoring_config WHERE id = 1"
-        ).fetchone()
-    return dict(row) if row else {"marks_correct": 4, "marks_wrong": -1}
+    cached = _SCORING_CACHE["v"]
+    now = time.monotonic()
+    if cached is not None and now - _SCORING_CACHE["t"] < _SCORING_CACHE_TTL:
+        return dict(cached)
+    # A bare read, not a `with` block: leaving one commits, which would end
+    # the transaction of a caller such as api_submit_attempt early.
+    row = get_connection().execute(
+        "SELECT marks_correct, marks_wrong FROM scoring_config WHERE id = 1"
+    ).fetchone()
+    config = dict(row) if row else {"marks_correct": 4, "marks_wrong": -1}
+    _SCORING_CACHE["v"], _SCORING_CACHE["t"] = config, now
+    return dict(config)
 
 
 def db_update_scoring_config(marks_correct: int, marks_wrong: int) -> None:
@@ -500,6 +847,7 @@ def db_update_scoring_config(marks_correct: int, marks_wrong: int) -> None:
             (marks_correct, marks_wrong),
         )
         conn.commit()
+    _SCORING_CACHE["v"] = None
 
 
 def db_set_question_answer(question_id: int, correct_option: str) -> bool:
@@ -513,56 +861,186 @@ def db_set_question_answer(question_id: int, correct_option: str) -> bool:
     return updated > 0
 
 
+# ── Parsed-PDF cache helpers ──────────────────────────────────────────────────
+# Re-uploading the same PDF (retakes, development) skips pdfplumber entirely.
+# Bump PDF_CACHE_VERSION whenever the parser's output changes so stale
+# entries from an older parser are not served.  Only the
+# PDF_CACHE_MAX_ENTRIES most recently used PDFs are kept.
+
+PDF_CACHE_VERSION     = 1
+PDF_CACHE_MAX_ENTRIES = int(os.environ.get("PDF_CACHE_MAX_ENTRIES", "50"))
+
+_QUESTION_IMAGE_FIELDS = (
+    "question_image",
+    "option_a_image", "option_b_image", "option_c_image", "option_d_image",
+)
+
+
+def pdf_cache_key(pdf_sha256: str) -> str:
+    return f"v{PDF_CACHE_VERSION}:{pdf_sha256}"
+
+
+def _cached_images_exist(questions: list[dict]) -> bool:
+    """True if every image file referenced by cached questions is still on disk."""
+    for q in questions:
+        paths = [q.get(f) for f in _QUESTION_IMAGE_FIELDS]
+        paths.extend((q.get("image_path") or "").split(","))
+        for p in paths:
+            if p and not os.path.exists(os.path.join(BASE_DIR, p.lstrip("/"))):
+                return False
+    return True
+
+
+def db_get_cached_parse(key: str) -> Optional[list[dict]]:
+    """Return cached questions for a PDF, or None on miss / missing images.
+
+    A hit refreshes the row's last_used; an entry whose image files have
+    gone from disk is dropped so the caller re-parses and re-caches it.
+    """
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT parsed_json FROM pdf_cache WHERE hash = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        questions = json.loads(row["parsed_json"])
+        if not _cached_images_exist(questions):
+            conn.execute("DELETE FROM pdf_cache WHERE hash = ?", (key,))
+            return None
+        conn.execute(
+            "UPDATE pdf_cache SET last_used = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE hash = ?", (key,)
+        )
+    return questions
+
+
+def db_cache_parse(key: str, questions: list[dict]) -> None:
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            """INSERT OR REPLACE INTO pdf_cache (hash, parsed_json, last_used)
+               VALUES (?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))""",
+            (key, json.dumps(questions, ensure_ascii=False)),
+        )
+        # LRU trim.  last_used has millisecond resolution; rows from before the
+        # column existed fall back to created_at.
+        conn.execute(
+            """DELETE FROM pdf_cache
+               WHERE hash NOT IN (
+                   SELECT hash FROM pdf_cache
+                   ORDER BY COALESCE(last_used, created_at) DESC, rowid DESC
+                   LIMIT ?
+               )""",
+            (max(PDF_CACHE_MAX_ENTRIES, 1),),
+        )
+
+
 # ── Startup ───────────────────────────────────────────────────────────────────
 
+# Worker threads shared by sync (def) routes and dependencies.  The API
+# handlers are plain def because every one of them blocks on sqlite3;
+# Starlette runs them here instead of on the event loop.  The default is
+# anyio's own 40: each thread holds a SQLite connection (~4 MB page cache at
+# most), and SQLite admits one writer at a time, so more threads mostly queue
+# on the write lock while adding memory.
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", "40"))
+
+
 @app.on_event("startup")
 def on_startup():
     init_auth_db()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
 
 
 # ──────────────────────────────────────────────
 # Regex patterns  (applied to .strip()-ed line text)
 # ──────────────────────────────────────────────
 
-# ── Numeric question with Q-prefix: Q1 Q1. Q.1 Q 1 Que 1 Question 1
-# Always valid \u2014 the prefix is an unambiguous signal.
-QUESTION_PREFIXED_RE = re.compile(
+# All question-header formats fused into one pattern, so each line needs a
+# single anchored match instead of up to five.  Alternatives are tried in the
+# parser's priority order; the outer named group (m.lastgroup) says which
+# form matched and the inner groups carry the number / body text.
+#
+#   roman       Roman numeral question: I. II. III. IV. V. …
+#               (the numeral may match empty – callers check it)
+#   roman_only  Roman numeral number-only line
+#   qnum_only   Number-only line (question number alone on its own line).
+#               REQUIRES a Q./Que/Question prefix — bare numbers like "1 2"
+#               or "0" from math subscripts/superscripts must NOT be treated
+#               as question headers.
+#   prefixed    Numeric question with Q-prefix: Q1 Q1. Q.1 Q 1 Que 1 Question 1
+#               Always valid \u2014 the prefix is an unambiguous signal.
+#   bare        Numeric question WITHOUT prefix: 1. 1) (1) 1:
+#               REQUIRES a separator (. ) :) after the number \u2014 bare
+#               "2 should be..." must NOT match (it's a math continuation line).
+#
+# A line matching an earlier alternative never needs a later one: a
+# non-empty roman numeral always wins, and whenever qnum_only matches, the
+# prefixed reading of the same line has no body text and is never used.
+QUESTION_HEADER_RE = re.compile(
     r"""
     ^\s*
     (?:
-        (?:Question|Que)\.?\s+
-      | Q\.?\s*
+        (?P<roman>
+            (?P<roman_num>
+                [Xx]{0,3}
+                (?:[Ii][Xx]|[Ii][Vv]|[Vv]?[Ii]{0,3})
+            )
+            (?!\()
+            \s*
+            [.:]
+            \s*
+            (?P<roman_text>.*)
+        )
+      |
+        (?P<roman_only>
+            (?P<roman_only_num>[Xx]{0,3}(?:[Ii][Xx]|[Ii][Vv]|[Vv]?[Ii]{0,3}))
+            (?!\()
+            \s*[.:]?\s*
+        )
+      |
+        (?P<qnum_only>
+            (?:[Qq][Uu][Ee](?:[Ss][Tt][Ii][Oo][Nn])?\.?\s+|[Qq]\.\s*)
+            \(?
+            (?P<qnum_only_num>0?\d{1,3})
+            \)?
+            \s*[.):\-]?\s*
+        )
+      |
+        (?P<prefixed>
+            (?:
+                [Qq][Uu][Ee](?:[Ss][Tt][Ii][Oo][Nn])?\.?\s+     # Question / Que, any case
+              | [Qq]\.?\s*
+            )
+            \(?
+            (?P<prefixed_num>0?\d{1,3})
+            \)?
+            \s*
+            [.):\u2013\-]?
+            \s*
+            (?P<prefixed_text>.*)
+        )
+      |
+        (?P<bare>
+            \(?
+            (?P<bare_num>0?\d{1,3})
+            \)?
+            \s*
+            [.):\u2013\-]       # separator is MANDATORY
+            \s*
+            (?P<bare_text>.*)
+        )
     )
-    \(?
-    (0?\d{1,3})
-    \)?
-    \s*
-    [.):\u2013\-]?
-    \s*
-    (.*)
-    $
-    """,
-    re.VERBOSE | re.IGNORECASE,
-)
-
-# ── Numeric question WITHOUT prefix: 1. 1) (1) 1:
-# REQUIRES a separator (. ) :) after the number \u2014 bare "2 should be..."
-# must NOT match (it's a math continuation line).
-QUESTION_BARE_NUM_RE = re.compile(
-    r"""
-    ^\s*
-    \(?
-    (0?\d{1,3})
-    \)?
-    \s*
-    [.):\u2013\-]       # separator is MANDATORY
-    \s*
-    (.*)
     $
     """,
     re.VERBOSE,
 )
 
+# First chars (after strip) of every line QUESTION_HEADER_RE can act on,
+# besides decimal digits: "(" / Q-prefix / roman numerals.  A line starting
+# with "." or ":" can only match the roman forms with an empty numeral,
+# which the parser ignores.  Any other line skips the regex entirely.
+_HEADER_START_CHARS = frozenset("(QqIiVvXx")
+
 # OCR-spaced question number, e.g. "2 1 2" → "212"
 QUESTION_OCR_SPACED_RE = re.compile(
     r"""
@@ -575,103 +1053,45 @@ QUESTION_OCR_SPACED_RE = re.compile(
     re.VERBOSE,
 )
 
-# Roman numeral question: I. II. III. IV. V. …
-QUESTION_ROMAN_RE = re.compile(
-    r"""
-    ^\s*
-    (
-        X{0,3}
-        (?:IX|IV|V?I{0,3})
-    )
-    (?!\()
-    \s*
-    [.:]
-    \s*
-    (.*)
-    $
-    """,
-    re.VERBOSE | re.IGNORECASE,
-)
-
-# Number-only line (question number alone on its own line)
-# REQUIRES a Q./Que/Question prefix — bare numbers like "1 2" or "0" from
-# math subscripts/superscripts must NOT be treated as question headers.
-QNUM_ONLY_RE = re.compile(
-    r"""
-    ^\s*
-    (?:(?:Question|Que)\.?\s+|Q\.\s*)
-    \(?
-    (0?\d{1,3})
-    \)?
-    \s*[.):\-]?\s*
-    $
-    """,
-    re.VERBOSE | re.IGNORECASE,
-)
-
-# Roman numeral number-only line
-QNUM_ROMAN_ONLY_RE = re.compile(
-    r"""
-    ^\s*
-    (X{0,3}(?:IX|IV|V?I{0,3}))
-    (?!\()
-    \s*[.:]?\s*
-    $
-    """,
-    re.VERBOSE | re.IGNORECASE,
-)
-
 # ── Option patterns ──────────────────────────────────────────────────────
 
-# Standard letter options: A) A. A: (A) [A] a) (a)
-# Allows empty text after label for diagram-reference options like "(A)" alone
-OPTION_LETTER_RE = re.compile(
-    r"""
-    ^\s*
-    [\(\[]?
-    ([A-Da-d])
-    [\)\].:]
-    \s*[-:]?\s*
-    (.*)
-    $
-    """,
-    re.VERBOSE,
-)
-
-# Roman numeral options: (i) (ii) (iii) (iv)
-OPTION_ROMAN_RE = re.compile(
-    r"""
-    ^\s*
-    \(
-    (i{1,3}|iv|v?i{0,3})
-    \)
-    \s*
-    (.+)
-    $
-    """,
-    re.VERBOSE | re.IGNORECASE,
-)
-
-# Numeric options: 1) 2) 3) 4) or 1. 2. 3. 4. (only when inside a question)
-OPTION_NUMERIC_RE = re.compile(
-    r"""
-    ^\s*
-    ([1-4])
-    [).]
-    \s+
-    (.+)
-    $
-    """,
-    re.VERBOSE,
-)
-
-# Bullet/dash options: • text  * text  - text  – text
-OPTION_BULLET_RE = re.compile(
+# All option formats fused into one pattern so _try_option needs a single
+# match per line instead of up to four.  Alternatives are tried in priority
+# order and a named group tells which one matched:
+#
+#   letter  Standard letter options: A) A. A: (A) [A] a) (a)
+#           Allows empty text after label for diagram-reference options
+#           like "(A)" alone
+#   roman   Roman numeral options: (i) (ii) (iii) (iv)   (any case)
+#   num     Numeric options: 1) 2) 3) 4) or 1. 2. 3. 4.
+#   bullet  Bullet/dash options: • text  * text  - text  – text
+#
+# Only the letter form counts outside a question (see _try_option).
+OPTION_RE = re.compile(
     r"""
     ^\s*
-    [•\*\-–]
-    \s+
-    (.+)
+    (?:
+        [\(\[]?
+        (?P<letter>[A-Da-d])
+        [\)\].:]
+        \s*[-:]?\s*
+        (?P<letter_text>.*)
+      |
+        \(
+        (?P<roman>[Ii]{1,3}|[Ii][Vv]|[Vv]?[Ii]{0,3})
+        \)
+        \s*
+        (?P<roman_text>.+)
+      |
+        (?P<num>[1-4])
+        [).]
+        \s+
+        (?P<num_text>.+)
+      |
+        [•\*\-–]
+        \s+
+        (?P<bullet_text>.+)
+    )
     $
     """,
     re.VERBOSE,
@@ -691,14 +1111,19 @@ STOP_PATTERNS = re.compile(
     )
     \b
     """,
-    re.VERBOSE | re.IGNORECASE,
+    re.VERBOSE,
 )
 
 NOISE_RE = re.compile(
     r"^\s*(?:page\s*\d+|\d+\s*/\s*\d+|www\.|http|©|copyright)\s*$",
-    re.IGNORECASE,
 )
 
+# A line *containing* "solution:" marks the start of the answer section.
+SOLUTION_MARKER_RE = re.compile(r"\bsolution\s*:")
+
+# Question body that is really an answer/solution reference ("Q.1 Answer: (B)").
+ANSWER_REF_RE = re.compile(r"\b(?:answer|solution)\b")
+
 
 # ──────────────────────────────────────────────
 # Helper utilities
@@ -729,64 +1154,71 @@ def _numeric_to_option_key(digit: str) -> str | None:
 
 def _try_option(line: str, in_question: bool) -> tuple[str | None, str | None]:
     """Try to match line as any option format."""
-    m = OPTION_LETTER_RE.match(line)
-    if m:
-        return _option_letter_to_key(m.group(1)), m.group(2).strip()
-    if in_question:
-        m = OPTION_ROMAN_RE.match(line)
-        if m:
-            key = _roman_option_to_key(m.group(1))
-            if key:
-                return key, m.group(2).strip()
-        m = OPTION_NUMERIC_RE.match(line)
-        if m:
-            key = _numeric_to_option_key(m.group(1))
-            if key:
-                return key, m.group(2).strip()
-        m = OPTION_BULLET_RE.match(line)
-        if m:
-            return "__bullet__", m.group(1).strip()
-    return None, None
+    m = OPTION_RE.match(line)
+    if not m:
+        return None, None
+    if m["letter"]:
+        return _option_letter_to_key(m["letter"]), m["letter_text"].strip()
+    if not in_question:
+        return None, None
+    if m["roman_text"] is not None:
+        key = _roman_option_to_key(m["roman"])
+        # An unmapped numeral such as "(v)" cannot match num/bullet either.
+        return (key, m["roman_text"].strip()) if key else (None, None)
+    if m["num"]:
+        return _numeric_to_option_key(m["num"]), m["num_text"].strip()
+    return "__bullet__", m["bullet_text"].strip()
+
+
+# Questions under construction track which options hold non-empty text in an
+# int bit-mask, q["_filled"] (a=1, b=2, c=4, d=8), so the parser's "is this
+# option taken?" checks are a single AND instead of dict lookups.  Options
+# must be written through _set_option to keep the mask in sync.
+_OPTION_KEYS = ("option_a", "option_b", "option_c", "option_d")
+_OPTION_BIT  = {key: 1 << i for i, key in enumerate(_OPTION_KEYS)}
+_ALL_OPTIONS = 0b1111
+
+
+def _set_option(q: dict, key: str, text: str) -> None:
+    q[key] = text
+    if text:
+        q["_filled"] |= _OPTION_BIT[key]
+    else:
+        q["_filled"] &= ~_OPTION_BIT[key]
+
+
+def _option_filled(q: dict, key: str) -> bool:
+    return bool(q["_filled"] & _OPTION_BIT[key])
 
 
 def _assign_bullet_option(current_q: dict, text: str) -> str | None:
-    for key in ("option_a", "option_b", "option_c", "option_d"):
-        if not current_q.get(key):
-            current_q[key] = text
-            return key
-    return None
+    free = ~current_q["_filled"] & _ALL_OPTIONS
+    if not free:
+        return None
+    key = _OPTION_KEYS[(free & -free).bit_length() - 1]   # lowest empty option
+    _set_option(current_q, key, text)
+    return key
 
 
 def _count_options(q: dict) -> int:
-    return sum(1 for k in ("option_a", "option_b", "option_c", "option_d") if q.get(k))
+    return q.get("_filled", 0).bit_count()
+
+
+_MATH_FRAGMENT_RE = re.compile(r"[A-Za-z0-9\[\]\(\)\+\-−=*/.:\s]+")
 
 
 def _looks_math_fragment(text: str) -> bool:
     t = text.strip()
     if not t or len(t) > 28:
         return False
-    return re.fullmatch(r"[A-Za-z0-9\[\]\(\)\+\-−=*/.:\s]+", t) is not None
-
+    return _MATH_FRAGMENT_RE.fullmatch(t) is not None
 
-# ── Math character normalization ──────────────────────────────────────────────
-# Some PDFs (especially Indian exam PDFs) use Symbol or custom math fonts where
-# glyph codes don't match the expected Unicode codepoints.  This table maps the
-# most common problematic encodings to their correct Unicode equivalents.
-_MATH_CHAR_MAP: dict[str, str] = {
-    "\uf028": "√",   # radical sign in some Symbol-variant fonts
-    "\uf0d6": "√",   # alternative radical encoding
-    "\uf0b0": "°",   # degree in Symbol font
-    "\uf0b2": "²",   # superscript 2 in some fonts
-    "\uf0b3": "³",   # superscript 3
-    "\uf02d": "−",   # minus in Symbol font
-    "\u221a": "√",   # U+221A – already correct, normalise to same char
-    "\u2212": "−",   # U+2212 minus – already correct
-}
 
-
-def _normalize_math_chars(text: str) -> str:
-    """Map known symbol-font mis-encodings to correct Unicode math characters."""
-    return "".join(_MATH_CHAR_MAP.get(c, c) for c in text)
+# Patterns used while merging / normalising option fragments.
+_DENOM_X_RE     = re.compile(r"\d*[Xx]\d")
+_DENOM_SUM_RE   = re.compile(r"\d+[+\-−][A-Za-z0-9]+")
+_SIGN_RE        = re.compile(r"[+\-−]")
+_MV_FRACTION_RE = re.compile(r"\b([Mm][Vv]2\s*0)\s*([23]?\s*[Xx]2\s*0)\b")
 
 
 def _append_option_text(existing: str | None, incoming: str) -> str:
@@ -808,22 +1240,23 @@ def _append_option_text(existing: str | None, incoming: str) -> str:
     if new_part in {"]", ")"}:
         return current + new_part
 
-    compact_current = re.sub(r"\s+", "", current)
-    compact_new = re.sub(r"\s+", "", new_part)
+    # str.split() drops exactly the characters \s matches, without a regex pass.
+    compact_current = "".join(current.split())
+    compact_new = "".join(new_part.split())
 
     # Subscript/exponent continuation like `mv2` + `0` -> `mv20`
-    if re.fullmatch(r"\d+", compact_new) and compact_current and compact_current[-1].isalnum():
+    if compact_new.isdecimal() and compact_current and compact_current[-1].isalnum():
         return current + compact_new
 
     starts_like_denominator = (
         compact_new.lower().startswith("x")
-        or re.match(r"^\d*x\d", compact_new, re.IGNORECASE) is not None
-        or re.match(r"^\d+[+\-−][A-Za-z0-9]+$", compact_new) is not None
+        or _DENOM_X_RE.match(compact_new) is not None
+        or _DENOM_SUM_RE.fullmatch(compact_new) is not None
     )
     current_looks_like_numerator = (
         current.endswith("]")
         or "mv" in compact_current.lower()
-        or re.search(r"[+\-−]", compact_current) is not None
+        or _SIGN_RE.search(compact_current) is not None
     )
 
     if (
@@ -838,10 +1271,14 @@ def _append_option_text(existing: str | None, incoming: str) -> str:
     return f"{current} {new_part}"
 
 
+# Option bodies repeat heavily across a paper ("2", "4", "None of these", …)
+# and the result depends only on the input string, so memoise the
+# split/join + regex work.
+@functools.lru_cache(maxsize=4096)
 def _normalize_math_option_text(text: str | None) -> str | None:
     if text is None:
         return None
-    normalized = re.sub(r"\s+", " ", text).strip()
+    normalized = " ".join(text.split())
     if not normalized or "/" in normalized:
         return normalized
 
@@ -850,153 +1287,23 @@ def _normalize_math_option_text(text: str | None) -> str | None:
     #   mv20x20      -> mv20 / x20
     #   mv202x20     -> mv20 / 2x20
     #   3 mv202 x20  -> 3 mv20 / 2 x20
-    normalized = re.sub(
-        r"(?i)\b(mv2\s*0)\s*([23]?\s*x2\s*0)\b",
-        r"\1 / \2",
-        normalized,
-    )
+    normalized = _MV_FRACTION_RE.sub(r"\1 / \2", normalized)
     return normalized
 
 
 # ──────────────────────────────────────────────
-# Text extraction: extract_text() + chars for Y-coordinates
-# ──────────────────────────────────────────────
-# Many JEE/NEET PDFs encode individual characters as separate glyphs with
-# wide inter-character spacing.  pdfplumber's extract_words() treats each
-# char as a separate "word" regardless of x_tolerance.
-#
-# However, extract_text() uses pdfplumber's internal layout engine which
-# correctly reconstructs words with proper spacing.  So we:
-#   1. Use extract_text() to get properly-spaced text lines.
-#   2. Use page.chars to build a Y-coordinate lookup for each line.
-#   3. Combine them into the same visual-line dicts the parser expects.
+# State-machine parser (operates on visual lines)
 # ──────────────────────────────────────────────
 
 # Indentation tolerance: if a continuation line's x0 is at least this many
 # points to the right of the option label's x0, treat it as continuation text.
 INDENT_TOL = 10.0
 
-# Tolerance for matching chars to a text line's Y-coordinate.
-LINE_Y_TOL = 5.0
-
-
-def _extract_text_lines(page) -> list[dict]:
-    """
-    Build visual lines directly from raw character data.
-
-    Groups chars by Y-position (LINE_Y_TOL tolerance), reconstructs text
-    by inserting spaces where there is a horizontal gap between chars, and
-    merges subscript/superscript rows (avg font-size < 80% of dominant)
-    into the preceding line.
-
-    This approach avoids the index-alignment bug that occurred when pairing
-    extract_text() lines with y_rows derived from chars — pdfplumber's
-    extract_text() folds subscripts inline while the char data keeps them on
-    separate Y-rows, causing a one-off mismatch for every subscript line.
 
-    Returns list of dicts sorted by vertical position:
-        [{"text": str, "top": float, "bottom": float, "x0": float}, …]
-    """
-    chars = page.chars or []
-    if not chars:
-        return []
-
-    # Sort chars by top Y then x0
-    sorted_chars = sorted(chars, key=lambda c: (float(c["top"]), float(c.get("x0", 0))))
-
-    # Group into Y-rows by top tolerance
-    rows: list[list] = []
-    current_row = [sorted_chars[0]]
-    current_top = float(sorted_chars[0]["top"])
-    for c in sorted_chars[1:]:
-        c_top = float(c["top"])
-        if abs(c_top - current_top) <= LINE_Y_TOL:
-            current_row.append(c)
-        else:
-            rows.append(current_row)
-            current_row = [c]
-            current_top = c_top
-    if current_row:
-        rows.append(current_row)
-
-    # Dominant font size (median across all chars)
-    all_sizes = sorted(
-        float(c.get("size", 0))
-        for row in rows
-        for c in row
-        if float(c.get("size", 0)) > 0
-    )
-    dominant_size = all_sizes[len(all_sizes) // 2] if all_sizes else 12.0
-
-    result: list[dict] = []
-    for row in rows:
-        row_sorted = sorted(row, key=lambda c: float(c.get("x0", 0)))
-
-        # Reconstruct text, inserting a space wherever char gap > 25% of font size
-        text_parts: list[str] = []
-        prev_x1: float | None = None
-        for c in row_sorted:
-            ch = c.get("text", "")
-            if not ch:
-                continue
-            x0 = float(c.get("x0", 0))
-            sz = float(c.get("size", dominant_size)) or dominant_size
-            x1 = float(c.get("x1", x0 + sz * 0.5))
-            if prev_x1 is not None and x0 - prev_x1 > sz * 0.25:
-                text_parts.append(" ")
-            text_parts.append(ch)
-            prev_x1 = max(prev_x1 or 0.0, x1)
-
-        text = "".join(text_parts).strip()
-        if not text:
-            continue
-
-        # Normalise symbol-font mis-encodings (e.g. \uf028 → √)
-        text = _normalize_math_chars(text)
-
-        avg_top  = sum(float(c["top"]) for c in row) / len(row)
-        avg_bot  = sum(float(c.get("bottom", c["top"] + 12)) for c in row) / len(row)
-        min_x0   = min(float(c.get("x0", 0)) for c in row)
-        sizes_row = [float(c.get("size", 0)) for c in row if float(c.get("size", 0)) > 0]
-        avg_size  = sum(sizes_row) / len(sizes_row) if sizes_row else 0.0
-
-        is_sub = avg_size > 0 and avg_size < dominant_size * 0.80
-
-        if is_sub and result:
-            prev = result[-1]
-            prev_center = (prev["top"] + prev["bottom"]) / 2.0
-            row_center  = avg_top + (avg_bot - avg_top) / 2.0
-            # Row center above previous line center → superscript; else subscript
-            if row_center < prev_center:
-                sup_map = str.maketrans("0123456789", "⁰¹²³⁴⁵⁶⁷⁸⁹")
-                text = text.translate(sup_map)
-            else:
-                sub_map = str.maketrans("0123456789", "₀₁₂₃₄₅₆₇₈₉")
-                text = text.translate(sub_map)
-            result[-1]["text"] += text
-            result[-1]["bottom"] = max(result[-1]["bottom"], avg_bot)
-        else:
-            result.append({
-                "text":   text,
-                "top":    avg_top,
-                "bottom": avg_bot,
-                "x0":     min_x0,
-            })
-
-    return result
-
-
-# ──────────────────────────────────────────────
-# State-machine parser (operates on visual lines)
-# ──────────────────────────────────────────────
-
-def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
+def parse_questions_from_lines(visual_lines: list[VLine]) -> list[dict]:
     """
     Coordinate-aware state-machine MCQ parser that works on spatially-grouped
-    visual lines.
-
-    Each entry in `visual_lines` is:
-        {"text": str, "top": float, "bottom": float, "x0": float}
+    visual lines (see VLine).
 
     States: IDLE → IN_QUESTION → IN_OPTIONS
 
@@ -1035,6 +1342,7 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
             "_y_start":      y_top,
             "_y_end":        y_top,
             "_opt_y":        {},   # {letter: y_top} recorded when each option first appears
+            "_filled":       0,    # bit-mask of non-empty options (see _set_option)
         }
 
     def _finish_question():
@@ -1042,7 +1350,7 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
         nonlocal current_q, last_option_key, last_option_x0
         if current_q is None:
             return
-        for key in ("option_a", "option_b", "option_c", "option_d"):
+        for key in _OPTION_KEYS:
             current_q[key] = _normalize_math_option_text(current_q.get(key))
         # Always emit the question (even with 0 options)
         questions.append(current_q)
@@ -1050,28 +1358,39 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
         last_option_key = None
         last_option_x0 = 0.0
 
+    # The per-line matchers, bound once: the loop body runs for every visual
+    # line of every page, so skip the global + attribute lookup on each call.
+    stop_match     = STOP_PATTERNS.match
+    solution_probe = SOLUTION_MARKER_RE.search
+    noise_match    = NOISE_RE.match
+    header_match   = QUESTION_HEADER_RE.match
+
     for vl in visual_lines:
-        line = vl["text"].strip()
-        y_top = vl["top"]
-        y_bot = vl["bottom"]
-        line_x0 = vl.get("x0", 0.0)
+        line = vl.text.strip()
+        y_top = vl.top
+        y_bot = vl.bottom
+        line_x0 = vl.x0
 
         if not line:
             continue
+        # Lowercased once for the keyword patterns below (STOP_PATTERNS,
+        # SOLUTION_MARKER_RE, NOISE_RE), which are written in lower case and
+        # compiled without re.IGNORECASE.
+        line_lower = line.lower()
 
         # ── Hard stop ─────────────────────────────────────────────────────────
-        if STOP_PATTERNS.match(line):
+        if stop_match(line_lower):
             _finish_question()
             stopped = True
         # Also stop when any line *contains* "solution:" (answer-section marker)
-        if not stopped and re.search(r"\bsolution\s*:", line, re.IGNORECASE):
+        if not stopped and solution_probe(line_lower):
             _finish_question()
             stopped = True
         if stopped:
             continue
 
         # ── Noise ─────────────────────────────────────────────────────────────
-        if NOISE_RE.match(line):
+        if noise_match(line_lower):
             continue
 
         # Track Y-extent of current question block
@@ -1080,15 +1399,19 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
 
         in_question_ctx = (state in ("IN_QUESTION", "IN_OPTIONS")) and current_q is not None
 
-        # ── 1. Roman numeral question (highest priority, any state) ───────────
-        q_rom_match  = QUESTION_ROMAN_RE.match(line)
-        qrom_only    = QNUM_ROMAN_ONLY_RE.match(line)
+        c0 = line[0]
+        if c0 in _HEADER_START_CHARS or c0.isdecimal():
+            header = header_match(line)
+            header_kind = header.lastgroup if header else None
+        else:
+            header = header_kind = None
 
-        if q_rom_match and q_rom_match.group(1):
+        # ── 1. Roman numeral question (highest priority, any state) ───────────
+        if header_kind == "roman" and header["roman_num"]:
             _finish_question()
             current_q = _make_question(
-                q_rom_match.group(1).upper(),
-                q_rom_match.group(2).strip(),
+                header["roman_num"].upper(),
+                header["roman_text"].strip(),
                 y_top
             )
             state = "IN_QUESTION"
@@ -1096,9 +1419,9 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
             last_option_x0 = 0.0
             continue
 
-        if qrom_only and qrom_only.group(1):
+        if header_kind == "roman_only" and header["roman_only_num"]:
             _finish_question()
-            current_q = _make_question(qrom_only.group(1).upper(), "", y_top)
+            current_q = _make_question(header["roman_only_num"].upper(), "", y_top)
             state = "IN_QUESTION"
             last_option_key = None
             last_option_x0 = 0.0
@@ -1108,41 +1431,38 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
         opt_key, opt_text = _try_option(line, in_question=in_question_ctx)
 
         # ── 3. Numeric question-number-only line ──────────────────────────────
-        qnum_only = QNUM_ONLY_RE.match(line)
+        qnum_only = header["qnum_only_num"] if header_kind == "qnum_only" else None
 
         # ── 4. Full numeric question line ──────────────────────────────────────
-        # Try prefixed pattern first (Q.1, Que 1, Question 1), then bare (1. 1) (1))
-        q_num_match = QUESTION_PREFIXED_RE.match(line)
-        q_num_has_prefix = bool(q_num_match)
-
-        if not q_num_match:
-            q_num_match = QUESTION_BARE_NUM_RE.match(line)
+        # Prefixed (Q.1, Que 1, Question 1) takes precedence over bare (1. 1) (1))
+        # by alternative order in QUESTION_HEADER_RE.
+        q_num: str | None = None
+        rest = ""
+        if header_kind in ("prefixed", "bare"):
+            q_num = header[header_kind + "_num"]
+            rest = header[header_kind + "_text"].strip()
 
-        if q_num_match:
-            num_str = q_num_match.group(1)
-            rest = q_num_match.group(2).strip()
-
-            if not _is_valid_question_start(num_str):
-                q_num_match = None
+            if not _is_valid_question_start(q_num):
+                q_num = None
 
             # If in options state and no body text, probably a numeric option
-            if q_num_match and state == "IN_OPTIONS" and current_q is not None:
+            if q_num and state == "IN_OPTIONS" and current_q is not None:
                 if not rest:
-                    q_num_match = None
+                    q_num = None
             # If line also matches as an option, prefer the option interpretation
-            if q_num_match and opt_key:
-                q_num_match = None
+            if q_num and opt_key:
+                q_num = None
 
             # Suppress if the body text is an answer/solution reference
             # e.g. "Q.1 Answer: (B)" or "Q1 Solution: ..." must NOT become questions
-            if q_num_match and re.search(r"\b(?:answer|solution)\b", rest, re.IGNORECASE):
-                q_num_match = None
+            if q_num and ANSWER_REF_RE.search(rest.lower()):
+                q_num = None
 
         # ── 5. OCR-spaced question number: "2 1 2" ────────────────────────────
         # ONLY match in IDLE state — inside a question, spaced digits are almost
         # always math subscripts / superscripts (e.g. m₁ m₂ rendering as "1 2").
         q_ocr_match = None
-        if state == "IDLE" and not q_num_match and not opt_key and not qnum_only:
+        if state == "IDLE" and not q_num and not opt_key and not qnum_only:
             q_ocr_match = QUESTION_OCR_SPACED_RE.match(line)
             if q_ocr_match:
                 collapsed = q_ocr_match.group(1).replace(" ", "")
@@ -1154,19 +1474,15 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
         if qnum_only and not opt_key:
             # Question number on its own line
             _finish_question()
-            current_q = _make_question(qnum_only.group(1), "", y_top)
+            current_q = _make_question(qnum_only, "", y_top)
             state = "IN_QUESTION"
             last_option_key = None
             last_option_x0 = 0.0
 
-        elif q_num_match and q_num_match.group(2).strip():
+        elif q_num and rest:
             # Full numeric question line with body text
             _finish_question()
-            current_q = _make_question(
-                q_num_match.group(1),
-                q_num_match.group(2).strip(),
-                y_top
-            )
+            current_q = _make_question(q_num, rest, y_top)
             state = "IN_QUESTION"
             last_option_key = None
             last_option_x0 = 0.0
@@ -1195,8 +1511,8 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
                     if letter not in current_q["_opt_y"]:
                         current_q["_opt_y"][letter] = y_top
             else:
-                if not current_q.get(opt_key):
-                    current_q[opt_key] = opt_text
+                if not _option_filled(current_q, opt_key):
+                    _set_option(current_q, opt_key, opt_text)
                     last_option_key = opt_key
                     last_option_x0 = line_x0
                     letter = opt_key[-1]  # 'a', 'b', 'c', 'd'
@@ -1217,11 +1533,13 @@ def parse_questions_from_lines(visual_lines: list[dict]) -> list[dict]:
                 if (last_option_key
                         and current_q.get(last_option_key) is not None
                         and line_x0 >= last_option_x0 + INDENT_TOL):
-                    current_q[last_option_key] = _append_option_text(current_q[last_option_key], line)
+                    _set_option(current_q, last_option_key,
+                                _append_option_text(current_q[last_option_key], line))
                 elif last_option_key and current_q.get(last_option_key) is not None:
                     # Same or less indentation — still append to last option
                     # (common for wrapped option text at same indent level)
-                    current_q[last_option_key] = _append_option_text(current_q[last_option_key], line)
+                    _set_option(current_q, last_option_key,
+                                _append_option_text(current_q[last_option_key], line))
 
     _finish_question()
     return questions
@@ -1232,142 +1550,77 @@ def parse_questions_from_text(full_text: str) -> list[dict]:
     """Parse MCQs from plain text (no spatial info). Lines get synthetic Y coords."""
     fake_lines = []
     for i, raw in enumerate(full_text.splitlines()):
-        fake_lines.append({"text": raw, "top": float(i), "bottom": float(i + 1), "x0": 0.0})
+        fake_lines.append(VLine(raw, float(i), float(i + 1), 0.0))
     questions = parse_questions_from_lines(fake_lines)
     for q in questions:
         q.pop("_num", None)
         q.pop("_y_start", None)
         q.pop("_y_end", None)
+        q.pop("_filled", None)
     return questions
 
 
 # ──────────────────────────────────────────────
-# Image extraction helpers
+# Question screenshot helper
 # ──────────────────────────────────────────────
 
-def _save_page_images(page, page_num: int) -> list[dict]:
-    """
-    Extract diagrams from a pdfplumber page.
-
-    Two sources are tried:
-      1. page.images  – embedded raster images (JPEG/PNG streams inside the PDF).
-      2. page.figures – bounding boxes of vector-graphic regions (lines, curves,
-                        fills drawn with PDF path operators).  This captures
-                        diagrams that were drawn rather than embedded, including
-                        diagrams that span two pages (each half is captured
-                        separately and both halves attach to the same question
-                        via the y_offset coordinate system in the caller).
-
-    Saves each region as PNG under static/images/.
-    Returns list of dicts: [{"path": web_path, "top": y_top, "bottom": y_bot}, …]
-    """
-    saved: list[dict] = []
-    MIN_DIM = 40.0   # PDF points (~56 px at 96 dpi); ignore tiny decorative elements
-
-    try:
-        from PIL import Image as _PILImage  # type: ignore  # noqa: PLC0415, F841
-    except ImportError:
-        print("[WARN] Pillow not installed – image extraction skipped.")
-        return saved
-
-    # ── 1. Embedded raster images ────────────────────────────────────────────
-    for idx, img_meta in enumerate(page.images or []):
-        try:
-            x0 = float(img_meta.get("x0", 0))
-            y0 = float(img_meta.get("top", img_meta.get("y0", 0)))
-            x1 = float(img_meta.get("x1", page.width))
-            y1 = float(img_meta.get("bottom", img_meta.get("y1", page.height)))
-
-            # pdfplumber's page.images uses top-origin coords (top < bottom).
-            top    = min(y0, y1)
-            bottom = max(y0, y1)
-            if top >= bottom or x0 >= x1:
-                continue
-
-            # Skip tiny decorative images (logos, favicons, footer strips)
-            if (x1 - x0) < MIN_DIM or (bottom - top) < MIN_DIM:
-                continue
+# Render resolution (dpi) of per-question screenshots.
+SCREENSHOT_RESOLUTION = 150
 
-            cropped = page.crop((x0, top, x1, bottom))
-            pil_img = cropped.to_image(resolution=150).original
 
-            fname    = f"page{page_num}_img{idx}_{uuid.uuid4().hex[:6]}.png"
-            out_path = os.path.join(IMAGES_DIR, fname)
-            pil_img.save(out_path, "PNG")
-            saved.append({"path": f"/static/images/{fname}", "top": top, "bottom": bottom})
-        except Exception as exc:  # noqa: BLE001
-            print(f"[WARN] Could not extract image on page {page_num} idx {idx}: {exc}")
-
-    # ── 2. Vector/drawn figures via page.figures ─────────────────────────────
-    # page.figures groups all path-based graphical objects (rects, lines, curves)
-    # into bounding-box regions.  This captures diagrams that are drawn rather
-    # than embedded, including those that span two pages.
-    for idx2, fig in enumerate(getattr(page, "figures", None) or []):
-        try:
-            fx0     = float(fig.get("x0", 0))
-            ftop    = float(fig.get("top", 0))
-            fx1     = float(fig.get("x1", page.width))
-            fbottom = float(fig.get("bottom", page.height))
-
-            if (fx1 - fx0) < MIN_DIM or (fbottom - ftop) < MIN_DIM:
-                continue
-
-            # Skip if a raster image already covers approximately the same region
-            fig_center_y = (ftop + fbottom) / 2.0
-            already_covered = any(
-                abs(((r["top"] + r["bottom"]) / 2.0) - fig_center_y) < 30
-                for r in saved
-            )
-            if already_covered:
-                continue
+def _page_render(pm: dict, renders: dict):
+    """Full-page 150 dpi render of page_meta entry `pm`, rendered at most once per `renders` cache."""
+    img = renders.get(pm["page_num"])
+    if img is None:
+        img = pm["page"].to_image(resolution=SCREENSHOT_RESOLUTION).original
+        renders[pm["page_num"]] = img
+    return img
 
-            cropped = page.crop((fx0, ftop, fx1, fbottom))
-            pil_img = cropped.to_image(resolution=150).original
 
-            fname    = f"page{page_num}_fig{idx2}_{uuid.uuid4().hex[:6]}.png"
-            out_path = os.path.join(IMAGES_DIR, fname)
-            pil_img.save(out_path, "PNG")
-            saved.append({"path": f"/static/images/{fname}", "top": ftop, "bottom": fbottom})
-        except Exception as exc:  # noqa: BLE001
-            print(f"[WARN] Could not render figure on page {page_num} idx2 {idx2}: {exc}")
-
-    return saved
-
-
-# ──────────────────────────────────────────────
-# Question screenshot helper
-# ──────────────────────────────────────────────
-
-def _crop_question_screenshot(
+def _crop_question_slices(
     page_meta: list[dict],
     y_start_global: float,
     y_end_global: float,
     q_idx: int,
-) -> str | None:
+    renders: dict,
+    page_starts: list[float],
+) -> list:
     """
-    Crop the full vertical span of a question, stitching across page boundaries.
+    Crop the full vertical span of a question, one slice per page.
 
     For every page whose visible area overlaps [y_start_global - PAD_TOP, y_end_global]:
       - Convert the overlap to page-local coordinates.
-      - Crop full page width for that slice and render at 150 dpi.
+      - Crop full page width for that slice out of the page's 150 dpi render.
+
+    `page_starts` holds each page_meta entry's y_offset (ascending); only the
+    pages whose range can overlap the question are visited, found by bisect.
 
-    Slices are stitched vertically (top → bottom) into one PIL image and saved.
+    Each page is rendered once and kept in `renders` (page_num → PIL image);
+    renders of pages above this question are dropped, so with questions in
+    document order only the one or two pages under the current question stay
+    in memory.  Cropping goes through pdfplumber's PageImage so the pixels
+    match rendering the cropped page directly.
 
     Only a small top padding (PAD_TOP) is applied; no padding is added below so
     the next question never bleeds into the screenshot.
 
-    Returns web path /static/images/… or None on failure.
+    Returns PIL images ordered top → bottom (empty on failure).
     """
-    try:
-        from PIL import Image as _PILImage  # type: ignore  # noqa: PLC0415
-    except ImportError:
-        return None
-
     PAD_TOP = 6.0  # PDF points of padding above the first line
 
     slices: list = []  # PIL images ordered top → bottom
 
-    for pm in page_meta:
+    # Pages are laid out top → bottom without overlap, so every page before
+    # `lo` ends above the padded question start and every page from `hi` on
+    # starts at or below its end.
+    lo = max(0, bisect.bisect_right(page_starts, y_start_global - PAD_TOP) - 1)
+    hi = bisect.bisect_left(page_starts, y_end_global)
+    if renders and lo < len(page_meta):
+        first_page = page_meta[lo]["page_num"]
+        for page_num in [n for n in renders if n < first_page]:
+            del renders[page_num]  # page is above this question
+
+    for pm in page_meta[lo:hi]:
         page_global_start = pm["y_offset"]
         page_global_end   = pm["y_offset"] + pm["height"]
 
@@ -1376,6 +1629,8 @@ def _crop_question_screenshot(
         overlap_end   = min(y_end_global,              page_global_end)
 
         if overlap_end <= overlap_start:
+            if page_global_end <= overlap_start:
+                renders.pop(pm["page_num"], None)  # page is above this question
             continue  # this page doesn't contribute
 
         # Convert overlap to page-local coordinates
@@ -1387,10 +1642,26 @@ def _crop_question_screenshot(
 
         try:
             cropped = pm["page"].crop((0, local_start, pm["page"].width, local_end))
-            slices.append(cropped.to_image(resolution=150).original)
+            slices.append(PageImage(
+                cropped,
+                original=_page_render(pm, renders),
+                resolution=SCREENSHOT_RESOLUTION,
+            ).original)
         except Exception as exc:  # noqa: BLE001
             print(f"[WARN] Crop failed Q{q_idx} page {pm['page_num']}: {exc}")
 
+    return slices
+
+
+def _save_question_screenshot(slices: list, q_idx: int) -> str | None:
+    """
+    Stitch slices vertically (top → bottom) into one PIL image and save it.
+
+    Touches no pdfplumber / pdfium state, so it is safe to run on a worker
+    thread (Pillow releases the GIL while encoding).
+
+    Returns web path /static/images/… or None on failure.
+    """
     if not slices:
         return None
 
@@ -1410,7 +1681,7 @@ def _crop_question_screenshot(
     try:
         fname    = f"qshot{q_idx}_{uuid.uuid4().hex[:6]}.png"
         out_path = os.path.join(IMAGES_DIR, fname)
-        final_img.save(out_path, "PNG")
+        final_img.save(out_path, "PNG", compress_level=PNG_COMPRESS_LEVEL)
         return f"/static/images/{fname}"
     except Exception as exc:  # noqa: BLE001
         print(f"[WARN] Save failed Q{q_idx}: {exc}")
@@ -1424,11 +1695,176 @@ def _crop_question_screenshot(
 # Y-axis tolerance (in PDF points) for attaching an image to a question.
 IMAGE_Y_TOLERANCE = 150.0
 
+# Text + image extraction is CPU-bound pure Python (pdfminer), so pages are
+# fanned out to worker processes.  PDFs shorter than _PARALLEL_MIN_PAGES are
+# extracted in-process: the hand-off costs more than it saves there.  The
+# worker entry point lives in pdf_extract, so a spawned worker imports that
+# module and pdfplumber only – not auth, the app or the database helpers.
+PDF_PAGE_WORKERS    = int(os.environ.get("PDF_PAGE_WORKERS", os.cpu_count() or 1))
+_PARALLEL_MIN_PAGES = 4
+
+_page_pool: ProcessPoolExecutor | None = None
+_page_pool_lock = threading.Lock()
+
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:  # created lazily: most processes never parse a PDF
+            # spawn, not fork: the server process is multi-threaded.
+            _page_pool = ProcessPoolExecutor(
+                max_workers=PDF_PAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _page_pool
+
+
+def _discard_page_pool(pool: ProcessPoolExecutor) -> None:
+    """Drop a failed pool (e.g. a worker crashed) so the next PDF gets a fresh one."""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is pool:
+            _page_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_all_pages(pdf_path: str, pages: list) -> list[tuple]:
+    """
+    extract_page for every page, in page order.
+
+    Each worker re-opens the PDF once and handles a contiguous block of pages.
+    A block whose worker fails is re-extracted in this process; blocks that
+    succeeded are kept, so their saved images are used rather than orphaned.
+    Only a broken pool (a worker died) is discarded – an exception raised by
+    one block leaves the pool usable for the next PDF.
+    """
+    n_pages = len(pages)
+    workers = min(PDF_PAGE_WORKERS, n_pages)
+    if workers <= 1 or n_pages < _PARALLEL_MIN_PAGES:
+        return [extract_page(page, n) for n, page in enumerate(pages, start=1)]
+
+    step = -(-n_pages // workers)
+    bounds = [
+        (first, min(first + step - 1, n_pages))
+        for first in range(1, n_pages + 1, step)
+    ]
+    pool = _get_page_pool()
+    try:
+        futures = [
+            pool.submit(extract_page_range, pdf_path, first, last)
+            for first, last in bounds
+        ]
+    except BrokenProcessPool as exc:
+        print(f"[WARN] Page worker pool is broken, extracting in-process: {exc}")
+        _discard_page_pool(pool)
+        return [extract_page(page, n) for n, page in enumerate(pages, start=1)]
+
+    extracted: list[tuple] = []
+    for (first, last), fut in zip(bounds, futures):
+        try:
+            extracted.extend(fut.result())
+            continue
+        except BrokenProcessPool as exc:
+            print(f"[WARN] Page worker died on pages {first}-{last}: {exc}")
+            _discard_page_pool(pool)
+        except Exception as exc:  # noqa: BLE001
+            # extract_page_range has already removed this block's images.
+            print(f"[WARN] Page worker failed on pages {first}-{last}: {exc}")
+        extracted.extend(extract_page(pages[n - 1], n) for n in range(first, last + 1))
+    return extracted
+
+
+def _build_question_y_index(q_ranges: list[tuple[float, float]]) -> tuple:
+    """
+    Precompute bisect-able bounds over question (y_start, y_end) ranges so
+    each image only visits the questions that can possibly own it.
+
+    Returns (end_hi, start_lo, endpoint_ys, endpoint_idx):
+      end_hi[i]    running max of y_end + tolerance over questions 0..i
+      start_lo[i]  running min of y_start − tolerance over questions i..n-1
+      endpoint_ys / endpoint_idx  every y_start / y_end, sorted by (y, index)
+    Both running bounds are monotone even if question ranges overlap, so the
+    windows they give are exact supersets of the matching questions.
+    """
+    end_hi: list[float] = []
+    hi = float("-inf")
+    for _y_start, y_end in q_ranges:
+        hi = max(hi, y_end + IMAGE_Y_TOLERANCE)
+        end_hi.append(hi)
+
+    start_lo: list[float] = [0.0] * len(q_ranges)
+    lo = float("inf")
+    for i in range(len(q_ranges) - 1, -1, -1):
+        lo = min(lo, q_ranges[i][0] - IMAGE_Y_TOLERANCE)
+        start_lo[i] = lo
+
+    endpoints = sorted(
+        (y, i) for i, rng in enumerate(q_ranges) for y in rng
+    )
+    return end_hi, start_lo, [y for y, _ in endpoints], [i for _, i in endpoints]
+
+
+def _nearest_question_by_y(
+    q_ranges: list[tuple[float, float]], y_index: tuple, center_y: float
+) -> int | None:
+    """
+    Index of the question an image centred at `center_y` belongs to.
+
+    Prefers questions whose range ± IMAGE_Y_TOLERANCE contains the image
+    (distance 0 when inside the range itself); otherwise falls back to the
+    question with the nearest start/end edge.  Ties go to the earliest
+    question, exactly as a linear scan over all questions would.
+    """
+    end_hi, start_lo, endpoint_ys, endpoint_idx = y_index
+    best_i: int | None = None
+    best_dist = float("inf")
+
+    # Tolerance pass: only questions in [lo, hi) can contain center_y.
+    lo = bisect.bisect_left(end_hi, center_y)
+    hi = bisect.bisect_right(start_lo, center_y)
+    for i in range(lo, hi):
+        y_start, y_end = q_ranges[i]
+        if y_start - IMAGE_Y_TOLERANCE <= center_y <= y_end + IMAGE_Y_TOLERANCE:
+            if y_start <= center_y <= y_end:
+                dist = 0.0
+            else:
+                dist = min(abs(center_y - y_start), abs(center_y - y_end))
+            if dist < best_dist:
+                best_dist = dist
+                best_i = i
+    if best_i is not None:
+        return best_i
+
+    # Fallback: nearest edge.  Distance is monotone on each side of center_y,
+    # so the closest edges are the runs of equal distance adjacent to the
+    # bisect point; scan just those for the earliest question.
+    pos = bisect.bisect_left(endpoint_ys, center_y)
+    n = len(endpoint_ys)
+    left_dist = abs(center_y - endpoint_ys[pos - 1]) if pos > 0 else float("inf")
+    right_dist = abs(center_y - endpoint_ys[pos]) if pos < n else float("inf")
+    best_dist = min(left_dist, right_dist)
+    if best_dist == float("inf"):
+        return None
+    if left_dist == best_dist:
+        j = pos - 1
+        while j >= 0 and abs(center_y - endpoint_ys[j]) == best_dist:
+            if best_i is None or endpoint_idx[j] < best_i:
+                best_i = endpoint_idx[j]
+            j -= 1
+    if right_dist == best_dist:
+        j = pos
+        while j < n and abs(center_y - endpoint_ys[j]) == best_dist:
+            if best_i is None or endpoint_idx[j] < best_i:
+                best_i = endpoint_idx[j]
+            j += 1
+    return best_i
+
 
 def parse_with_diagram_info(pdf_path: str) -> list[dict]:
     """
     Full spatial pipeline:
-      1. For each page, extract text lines (with Y-coords) and embedded images.
+      1. For each page, extract text lines (with Y-coords) and embedded images
+         (fanned out to worker processes for longer PDFs).
       2. Collect a page_meta list so page objects stay accessible while PDF is open.
       3. Parse MCQs from the accumulated visual lines.
       4. Attach embedded images to questions by Y-position.
@@ -1437,36 +1873,31 @@ def parse_with_diagram_info(pdf_path: str) -> list[dict]:
       7. Clean up internal metadata fields.
 
     All processing is done inside the pdfplumber.open() 'with' block so that
-    page objects remain valid when _crop_question_screenshot() needs them.
+    page objects remain valid when _crop_question_slices() needs them.
     """
-    all_visual_lines: list[dict] = []
+    all_visual_lines: list[VLine] = []
     all_images: list[dict] = []
     page_meta: list[dict] = []   # {page, y_offset, height, page_num}
     y_offset = 0.0
 
     with pdfplumber.open(pdf_path) as pdf:
         # ── Pass 1: collect text lines, images, and page metadata ───────────
-        for page_num, page in enumerate(pdf.pages, start=1):
+        pages = pdf.pages
+        extracted = _extract_all_pages(pdf_path, pages)
+        for page_num, (page, (page_lines, page_imgs)) in enumerate(
+            zip(pages, extracted), start=1
+        ):
             page_y_start = y_offset
 
-            try:
-                page_lines = _extract_text_lines(page)
-                if page_lines:
-                    for pl in page_lines:
-                        pl["top"]    += y_offset
-                        pl["bottom"] += y_offset
-                    all_visual_lines.extend(page_lines)
-            except Exception as exc:  # noqa: BLE001
-                print(f"[WARN] Skipping text on page {page_num}: {exc}")
+            for pl in page_lines:
+                pl.top    += y_offset
+                pl.bottom += y_offset
+            all_visual_lines.extend(page_lines)
 
-            try:
-                page_imgs = _save_page_images(page, page_num)
-                for img in page_imgs:
-                    img["top"]    += y_offset
-                    img["bottom"] += y_offset
-                all_images.extend(page_imgs)
-            except Exception as exc:  # noqa: BLE001
-                print(f"[WARN] Image extraction failed on page {page_num}: {exc}")
+            for img in page_imgs:
+                img["top"]    += y_offset
+                img["bottom"] += y_offset
+            all_images.extend(page_imgs)
 
             page_meta.append({
                 "page":     page,
@@ -1479,51 +1910,30 @@ def parse_with_diagram_info(pdf_path: str) -> list[dict]:
         # ── Parse questions (inside 'with' so page objects remain live) ──────
         questions = parse_questions_from_lines(all_visual_lines)
 
-        # Build a coord-lookup so the second pass can find image positions by path
-        path_to_coords: dict[str, tuple[float, float]] = {
-            img["path"]: (img["top"], img["bottom"]) for img in all_images
-        }
+        # Question Y-ranges, read once and indexed so each image is matched
+        # by bisect instead of scanning every question twice.
+        q_ranges = [(q.get("_y_start", 0), q.get("_y_end", 0)) for q in questions]
+        y_index = _build_question_y_index(q_ranges)
 
         # ── First pass: attach embedded images to questions by Y-position ────
+        # Attached images are collected per question and only joined into the
+        # comma-separated image_path once, after option promotion below.
+        q_images: list[list[dict]] = [[] for _ in questions]
         for img in all_images:
             img_center_y = (img["top"] + img["bottom"]) / 2.0
-            best_q = None
-            best_dist = float("inf")
-
-            for q in questions:
-                y_start = q.get("_y_start", 0)
-                y_end   = q.get("_y_end", 0)
-                range_top    = y_start - IMAGE_Y_TOLERANCE
-                range_bottom = y_end   + IMAGE_Y_TOLERANCE
-                if range_top <= img_center_y <= range_bottom:
-                    if y_start <= img_center_y <= y_end:
-                        dist = 0.0
-                    else:
-                        dist = min(abs(img_center_y - y_start), abs(img_center_y - y_end))
-                    if dist < best_dist:
-                        best_dist = dist
-                        best_q = q
-
-            if best_q is None:
-                for q in questions:
-                    y_start = q.get("_y_start", 0)
-                    y_end   = q.get("_y_end", 0)
-                    dist = min(abs(img_center_y - y_start), abs(img_center_y - y_end))
-                    if dist < best_dist:
-                        best_dist = dist
-                        best_q = q
-
-            if best_q is not None:
-                best_q["has_diagram"] = 1
-                if best_q["image_path"] is None:
-                    best_q["image_path"] = img["path"]
-                else:
-                    best_q["image_path"] += "," + img["path"]
+            best_i = _nearest_question_by_y(q_ranges, y_index, img_center_y)
+
+            if best_i is not None:
+                questions[best_i]["has_diagram"] = 1
+                q_images[best_i].append(img)
 
         # ── Second pass: promote question-level images to per-option images ──
-        for q in questions:
+        for q, imgs in zip(questions, q_images):
+            if not imgs:
+                continue
             opt_y: dict[str, float] = q.get("_opt_y", {})
-            if not opt_y or not q.get("image_path"):
+            if not opt_y:
+                q["image_path"] = ",".join(img["path"] for img in imgs)
                 continue
 
             letters_sorted = sorted(opt_y.keys())
@@ -1536,14 +1946,10 @@ def parse_with_diagram_info(pdf_path: str) -> list[dict]:
                     y_e = q.get("_y_end", y_s) + IMAGE_Y_TOLERANCE
                 opt_ranges[letter] = (y_s, y_e)
 
-            paths = q["image_path"].split(",")
             remaining: list[str] = []
-            for path in paths:
-                coords = path_to_coords.get(path)
-                if coords is None:
-                    remaining.append(path)
-                    continue
-                cy = (coords[0] + coords[1]) / 2.0
+            for img in imgs:
+                path = img["path"]
+                cy = (img["top"] + img["bottom"]) / 2.0
                 matched_letter: str | None = None
                 for letter, (y_s, y_e) in opt_ranges.items():
                     if y_s - 20 <= cy <= y_e:
@@ -1559,6 +1965,12 @@ def parse_with_diagram_info(pdf_path: str) -> list[dict]:
             q["image_path"] = ",".join(remaining) if remaining else None
 
         # ── Screenshot pass: crop each question's region as a PNG ───────────
+        # Cropping renders through pdfium, which is not thread-safe, so it
+        # stays on this thread; stitching + PNG encoding go to a thread pool.
+        renders: dict = {}
+        page_starts = [pm["y_offset"] for pm in page_meta]
+        shot_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+        shots = []
         for idx, q in enumerate(questions):
             q_y_start = q.get("_y_start", 0.0)
             q_y_end   = q.get("_y_end",   0.0)
@@ -1569,9 +1981,15 @@ def parse_with_diagram_info(pdf_path: str) -> list[dict]:
                 next_y_start = questions[idx + 1].get("_y_start", q_y_end)
                 q_y_end = min(q_y_end, next_y_start)
 
-            q["question_image"] = _crop_question_screenshot(
-                page_meta, q_y_start, q_y_end, idx + 1
+            slices = _crop_question_slices(
+                page_meta, q_y_start, q_y_end, idx + 1, renders, page_starts
             )
+            shots.append(shot_pool.submit(_save_question_screenshot, slices, idx + 1))
+        renders.clear()
+
+        with shot_pool:
+            for q, shot in zip(questions, shots):
+                q["question_image"] = shot.result()
 
         # ── Clean up internal metadata ────────────────────────────────────────
         for q in questions:
@@ -1579,6 +1997,7 @@ def parse_with_diagram_info(pdf_path: str) -> list[dict]:
             q.pop("_y_start", None)
             q.pop("_y_end", None)
             q.pop("_opt_y", None)
+            q.pop("_filled", None)
 
     return questions
 
@@ -1587,14 +2006,19 @@ def parse_with_diagram_info(pdf_path: str) -> list[dict]:
 # Pydantic request models
 # ──────────────────────────────────────────────
 
+# Emails are matched case-insensitively: pydantic-core strips and lower-cases
+# them during validation, so handlers receive the normalised form.
+NormalizedEmail = Annotated[str, StringConstraints(strip_whitespace=True, to_lower=True)]
+
+
 class SignupRequest(BaseModel):
     username: str
-    email: str
+    email: NormalizedEmail
     password: str
 
 
 class LoginRequest(BaseModel):
-    email: str
+    email: NormalizedEmail
     password: str
 
 
@@ -1636,104 +2060,122 @@ class SubmitAttemptRequest(BaseModel):
 
 # ── Static HTML pages ─────────────────────────
 
+# Page bytes by file name, read on first request.  The HTML is static for the
+# life of the process, so later hits skip the open/read on the event loop.
+# HTML_CACHE=0 (e.g. while editing static/*.html) streams the file from disk
+# on every request instead – FileResponse sends it without blocking the loop.
+HTML_CACHE = os.environ.get("HTML_CACHE", "1") != "0"
+_HTML_CACHE: dict[str, bytes] = {}
+
+
+def _html_page(name: str) -> Response:
+    if not HTML_CACHE:
+        return FileResponse(os.path.join(STATIC_DIR, name), media_type="text/html")
+    body = _HTML_CACHE.get(name)
+    if body is None:
+        with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+            body = _HTML_CACHE[name] = f.read().encode("utf-8")
+    return HTMLResponse(body)
+
+
 @app.get("/", response_class=HTMLResponse)
 async def serve_index():
-    with open(os.path.join(STATIC_DIR, "index.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("index.html")
 
 
 @app.get("/login", response_class=HTMLResponse)
 async def serve_login():
-    with open(os.path.join(STATIC_DIR, "login.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("login.html")
 
 
 @app.get("/signup", response_class=HTMLResponse)
 async def serve_signup():
-    with open(os.path.join(STATIC_DIR, "signup.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("signup.html")
 
 
 @app.get("/test", response_class=HTMLResponse)
 async def serve_test():
-    with open(os.path.join(STATIC_DIR, "test.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("test.html")
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
 async def serve_dashboard():
-    with open(os.path.join(STATIC_DIR, "dashboard.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("dashboard.html")
 
 
 @app.get("/result", response_class=HTMLResponse)
 async def serve_result():
-    with open(os.path.join(STATIC_DIR, "result.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("result.html")
 
 
 @app.get("/exams", response_class=HTMLResponse)
 async def serve_exams():
-    with open(os.path.join(STATIC_DIR, "exams.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("exams.html")
 
 
 @app.get("/reports", response_class=HTMLResponse)
 async def serve_reports():
-    with open(os.path.join(STATIC_DIR, "reports.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("reports.html")
 
 
 @app.get("/settings", response_class=HTMLResponse)
 async def serve_settings():
-    with open(os.path.join(STATIC_DIR, "settings.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("settings.html")
 
 
 @app.get("/privacy", response_class=HTMLResponse)
 async def serve_privacy():
-    with open(os.path.join(STATIC_DIR, "privacy.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("privacy.html")
 
 
 @app.get("/support", response_class=HTMLResponse)
 async def serve_support():
-    with open(os.path.join(STATIC_DIR, "support.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("support.html")
 
 
 @app.get("/terms", response_class=HTMLResponse)
 async def serve_terms():
-    with open(os.path.join(STATIC_DIR, "terms.html"), encoding="utf-8") as f:
-        return f.read()
+    return _html_page("terms.html")
 
 
 # ── Auth API ──────────────────────────────────
+# These two stay async because they await password hashing; their sqlite3
+# calls are sent to the threadpool so they never block the event loop.
 
 @app.post("/api/auth/signup")
 async def api_signup(body: SignupRequest):
     if len(body.password) < 6:
         raise HTTPException(status_code=400, detail="Password must be at least 6 characters.")
-    if db_get_user_by_email(body.email):
+    if await run_in_threadpool(db_get_user_by_email, body.email):
         raise HTTPException(status_code=409, detail="An account with this email already exists.")
-    hashed = hash_password(body.password)
-    user_id = db_create_user(body.email.lower().strip(), body.username.strip(), hashed)
-    token = create_access_token(user_id, body.email.lower().strip())
+    hashed = await ahash_password(body.password)
+    user_id = await run_in_threadpool(
+        db_create_user, body.email, body.username.strip(), hashed
+    )
+    token = create_access_token(user_id, body.email)
     return {"token": token, "user_id": user_id, "username": body.username}
 
 
 @app.post("/api/auth/login")
 async def api_login(body: LoginRequest):
-    user = db_get_user_by_email(body.email.lower().strip())
-    if not user or not verify_password(body.password, user["password_hash"]):
+    user = await run_in_threadpool(db_get_user_by_email, body.email)
+    # Always run a hash check, even for unknown emails (timing-safe).
+    password_ok = await averify_password(
+        body.password, user["password_hash"] if user else None
+    )
+    if not user or not password_ok:
         raise HTTPException(status_code=401, detail="Invalid email or password.")
+    # Lazily migrate legacy bcrypt hashes (and stale argon2 params) to argon2id.
+    if needs_rehash(user["password_hash"]):
+        new_hash = await ahash_password(body.password)
+        await run_in_threadpool(db_update_password_hash, user["id"], new_hash)
     token = create_access_token(user["id"], user["email"])
     return {"token": token, "user_id": user["id"], "username": user["username"]}
 
 
 @app.get("/api/auth/me")
-async def api_me(current_user: dict = Depends(get_current_user)):
-    user = db_get_user_by_id(current_user["user_id"])
+def api_me(current_user: AuthUser = Depends(get_current_user)):
+    user = db_get_user_by_id(current_user.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found.")
     return user
@@ -1742,9 +2184,9 @@ async def api_me(current_user: dict = Depends(get_current_user)):
 # ── Test attempt API ──────────────────────────
 
 @app.post("/api/attempt/start")
-async def api_start_attempt(
+def api_start_attempt(
     body: StartAttemptRequest,
-    current_user: dict = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
 ):
     # Reuse an existing ongoing attempt for the same user + pdf to prevent
     # duplicates when the /test page is refreshed or revisited.
@@ -1753,13 +2195,13 @@ async def api_start_attempt(
             """SELECT id FROM test_attempts
                WHERE user_id = ? AND pdf_name = ? AND status = 'ongoing'
                ORDER BY id DESC LIMIT 1""",
-            (current_user["user_id"], body.pdf_name),
+            (current_user.user_id, body.pdf_name),
         ).fetchone()
     if existing:
         return {"attempt_id": existing["id"]}
 
     attempt_id = db_create_attempt(
-        user_id=current_user["user_id"],
+        user_id=current_user.user_id,
         pdf_name=body.pdf_name,
         total_questions=body.total_questions,
         duration=body.duration,
@@ -1768,29 +2210,29 @@ async def api_start_attempt(
 
 
 @app.post("/api/attempt/{attempt_id}/answer")
-async def api_save_answer(
+def api_save_answer(
     attempt_id: int,
     body: SaveAnswerRequest,
-    current_user: dict = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
 ):
     attempt = db_get_attempt(attempt_id)
     if not attempt:
         raise HTTPException(status_code=404, detail="Attempt not found.")
-    if attempt["user_id"] != current_user["user_id"]:
+    if attempt["user_id"] != current_user.user_id:
         raise HTTPException(status_code=403, detail="Forbidden.")
     if attempt["status"] != "ongoing":
         raise HTTPException(status_code=400, detail="Attempt is already completed.")
-    if body.chosen_key not in ("a", "b", "c", "d"):
+    if body.chosen_key not in _VALID_KEYS:
         raise HTTPException(status_code=400, detail="chosen_key must be a, b, c, or d.")
     db_upsert_answer(attempt_id, body.question_id, body.chosen_key)
     return {"ok": True}
 
 
 @app.post("/api/attempt/{attempt_id}/submit")
-async def api_submit_attempt(
+def api_submit_attempt(
     attempt_id: int,
     body: SubmitAttemptRequest,
-    current_user: dict = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
 ):
     """Submit a test attempt and return a structured scoring summary.
 
@@ -1808,7 +2250,7 @@ async def api_submit_attempt(
     attempt = db_get_attempt(attempt_id)
     if not attempt:
         raise HTTPException(status_code=404, detail="Attempt not found.")
-    if attempt["user_id"] != current_user["user_id"]:
+    if attempt["user_id"] != current_user.user_id:
         raise HTTPException(status_code=403, detail="Forbidden.")
 
     if attempt["status"] == "completed":
@@ -1822,37 +2264,59 @@ async def api_submit_attempt(
             "per_question_time": db_get_time_spent(attempt_id),
         }
 
-    # ── 1. Persist final answer state ────────────────────────────────────────
     # Overwrite any interim answers with the definitive frontend state.
-    valid_keys = {"a", "b", "c", "d"}
+    # Malformed question_ids are dropped up front (including ones outside
+    # SQLite's 64-bit INTEGER range) so one bad entry cannot fail the batch.
+    answers: list[tuple[int, str]] = []
     for qid_str, key in body.answers.items():
-        if key not in valid_keys:
+        if key not in _VALID_KEYS:
             continue
         try:
-            db_upsert_answer(attempt_id, int(qid_str), key)
-        except (ValueError, Exception):
-            pass  # skip malformed question_ids
-
-    # ── 2. Score server-side (never trust client score) ──────────────────────
-    result = calculate_score_detailed(attempt_id)
+            qid = int(qid_str)
+        except (ValueError, TypeError):
+            continue
+        if -_SQLITE_INT_LIMIT <= qid < _SQLITE_INT_LIMIT:
+            answers.append((qid, key))
 
-    # ── 3. Time accounting ───────────────────────────────────────────────────
     total_time = int(sum(
         v for v in body.time_spent.values()
         if isinstance(v, (int, float)) and v >= 0
     ))
-    if body.time_spent:
-        db_save_time_spent(attempt_id, body.time_spent)
-
-    # ── 4. Lock attempt with full summary ────────────────────────────────────
-    db_complete_attempt(
-        attempt_id,
-        score      = result["score"],
-        correct    = result["correct"],
-        wrong      = result["wrong"],
-        unanswered = result["unanswered"],
-        total_time = total_time,
-    )
+
+    # Steps 1–4 share one write transaction: a single commit (one WAL sync)
+    # per submit, and an error part-way leaves the attempt untouched.
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+
+        # ── 1. Persist final answer state ────────────────────────────────────
+        db_upsert_answers(attempt_id, answers, conn)
+
+        # ── 2. Score server-side (never trust client score) ──────────────────
+        result = calculate_score_detailed(attempt_id, conn)
+
+        # ── 3. Time accounting ───────────────────────────────────────────────
+        if body.time_spent:
+            db_save_time_spent(attempt_id, body.time_spent, conn)
+
+        # ── 4. Lock attempt with full summary ────────────────────────────────
+        # The per-question breakdown is snapshotted with the score, so later
+        # views of the result are a single row read and stay consistent with
+        # the locked score even if the question set or answer key changes.
+        time_spent = db_get_time_spent(attempt_id, conn)
+        results = {
+            "per_question_time": time_spent,
+            "breakdown":         db_get_breakdown(attempt_id, time_spent, conn),
+        }
+        db_complete_attempt(
+            attempt_id,
+            score        = result["score"],
+            correct      = result["correct"],
+            wrong        = result["wrong"],
+            unanswered   = result["unanswered"],
+            total_time   = total_time,
+            results_json = orjson.dumps(results).decode(),
+            conn         = conn,
+        )
 
     return {
         "score":             result["score"],
@@ -1860,82 +2324,45 @@ async def api_submit_attempt(
         "wrong":             result["wrong"],
         "unanswered":        result["unanswered"],
         "total_time":        total_time,
-        "per_question_time": db_get_time_spent(attempt_id),
+        "per_question_time": time_spent,
     }
 
 
 @app.get("/api/attempt/{attempt_id}")
-async def api_get_attempt(
+def api_get_attempt(
     attempt_id: int,
-    current_user: dict = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
 ):
     attempt = db_get_attempt(attempt_id)
     if not attempt:
         raise HTTPException(status_code=404, detail="Attempt not found.")
-    if attempt["user_id"] != current_user["user_id"]:
+    if attempt["user_id"] != current_user.user_id:
         raise HTTPException(status_code=403, detail="Forbidden.")
 
-    time_spent = db_get_time_spent(attempt_id)
-
-    with get_connection() as conn:
-        # User answers with correct options for each answered question
-        answer_rows = conn.execute(
-            """SELECT ua.question_id, ua.chosen_key, q.correct_option
-               FROM   user_answers ua
-               JOIN   questions    q  ON q.id = ua.question_id
-               WHERE  ua.attempt_id = ?""",
-            (attempt_id,),
-        ).fetchall()
-
-        # All questions in display order (id == display order after init_db)
-        question_rows = conn.execute(
-            "SELECT id, correct_option FROM questions ORDER BY id"
-        ).fetchall()
-
-    # Build O(1) lookup: question_id → answered row
-    answer_map = {r["question_id"]: r for r in answer_rows}
-
-    # One breakdown entry per question
-    breakdown = []
-    for num, q in enumerate(question_rows, start=1):
-        qid    = q["id"]
-        ans    = answer_map.get(qid)
-        chosen  = ans["chosen_key"]    if ans else None
-        correct = q["correct_option"]
-
-        if chosen is None:
-            status = "unanswered"
-        elif chosen == correct:
-            status = "correct"
-        else:
-            status = "wrong"
-
-        breakdown.append({
-            "question_num":   num,
-            "question_id":    qid,
-            "chosen_key":     chosen,
-            "correct_option": correct,
-            "time_seconds":   time_spent.get(str(qid), 0),
-            "status":         status,
-        })
+    # Completed attempts carry the snapshot taken at submit; ongoing ones
+    # (and ones completed before snapshots existed) are computed live.
+    results_json = attempt.pop("results_json", None)
+    if results_json is not None:
+        return {**attempt, **orjson.loads(results_json)}
 
+    time_spent = db_get_time_spent(attempt_id)
     return {
-        **dict(attempt),
+        **attempt,
         "per_question_time": time_spent,
-        "breakdown":         breakdown,
+        "breakdown":         db_get_breakdown(attempt_id, time_spent),
     }
 
 
 @app.delete("/api/attempt/{attempt_id}")
-async def api_delete_attempt(
+def api_delete_attempt(
     attempt_id: int,
-    current_user: dict = Depends(get_current_user),
+    current_user: AuthUser = Depends(get_current_user),
 ):
     """Delete a test attempt and all associated answer/time data."""
     attempt = db_get_attempt(attempt_id)
     if not attempt:
         raise HTTPException(status_code=404, detail="Attempt not found.")
-    if attempt["user_id"] != current_user["user_id"]:
+    if attempt["user_id"] != current_user.user_id:
         raise HTTPException(status_code=403, detail="Forbidden.")
     with get_connection() as conn:
         conn.execute("DELETE FROM question_time_spent WHERE attempt_id = ?", (attempt_id,))
@@ -1946,49 +2373,88 @@ async def api_delete_attempt(
 
 
 @app.delete("/api/attempts/all")
-async def api_delete_all_attempts(
-    current_user: dict = Depends(get_current_user),
+def api_delete_all_attempts(
+    current_user: AuthUser = Depends(get_current_user),
 ):
     """Delete ALL test attempts for the current user."""
+    # Three set-based deletes (children first, keyed by the user's attempts),
+    # whatever the number of attempts; the last one's rowcount is the count.
+    uid = (current_user.user_id,)
     with get_connection() as conn:
-        attempt_ids = [
-            r["id"] for r in conn.execute(
-                "SELECT id FROM test_attempts WHERE user_id = ?",
-                (current_user["user_id"],),
-            ).fetchall()
-        ]
-        for aid in attempt_ids:
-            conn.execute("DELETE FROM question_time_spent WHERE attempt_id = ?", (aid,))
-            conn.execute("DELETE FROM user_answers WHERE attempt_id = ?", (aid,))
         conn.execute(
-            "DELETE FROM test_attempts WHERE user_id = ?",
-            (current_user["user_id"],),
+            """DELETE FROM question_time_spent WHERE attempt_id IN
+                   (SELECT id FROM test_attempts WHERE user_id = ?)""",
+            uid,
         )
+        conn.execute(
+            """DELETE FROM user_answers WHERE attempt_id IN
+                   (SELECT id FROM test_attempts WHERE user_id = ?)""",
+            uid,
+        )
+        deleted = conn.execute(
+            "DELETE FROM test_attempts WHERE user_id = ?", uid,
+        ).rowcount
         conn.commit()
-    return {"ok": True, "deleted": len(attempt_ids)}
+    return {"ok": True, "deleted": deleted}
 
 
 @app.get("/api/attempts")
-async def api_get_attempts(current_user: dict = Depends(get_current_user)):
-    attempts = db_get_user_attempts(current_user["user_id"])
+def api_get_attempts(current_user: AuthUser = Depends(get_current_user)):
+    attempts = db_get_user_attempts(current_user.user_id)
     return attempts
 
 
 # ── PDF upload ────────────────────────────────
 
+def _replace_questions(questions: list[dict]) -> None:
+    """Swap the current question set for `questions` (one threadpool hop)."""
+    init_db()
+    insert_questions(questions)
+
+
+_UPLOAD_CHUNK = 1 << 20   # 1 MiB
+
+
+def _spool_upload(src) -> tuple[str, str]:
+    """Copy an uploaded file to a temp .pdf in chunks, hashing as it goes.
+
+    Returns (temp path, SHA-256 hex digest).  Memory use stays at one chunk
+    whatever the PDF size; the caller unlinks the file.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+        try:
+            while chunk := src.read(_UPLOAD_CHUNK):
+                digest.update(chunk)
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    return tmp.name, digest.hexdigest()
+
+
 @app.post("/upload")
 async def upload_pdf(file: UploadFile = File(...)):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are accepted.")
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-
+    tmp_path, pdf_sha256 = await run_in_threadpool(_spool_upload, file.file)
     try:
-        questions = parse_with_diagram_info(tmp_path)
-    except Exception as exc:
-        raise HTTPException(status_code=500, detail=f"PDF read error: {exc}") from exc
+        cache_key = pdf_cache_key(pdf_sha256)
+        questions = await run_in_threadpool(db_get_cached_parse, cache_key)
+
+        if questions is None:
+            try:
+                # pdfplumber parsing + image rendering is seconds of blocking
+                # CPU work; run it in the threadpool so other requests keep
+                # flowing.
+                questions = await run_in_threadpool(parse_with_diagram_info, tmp_path)
+            except Exception as exc:
+                raise HTTPException(status_code=500, detail=f"PDF read error: {exc}") from exc
+
+            if questions:
+                await run_in_threadpool(db_cache_parse, cache_key, questions)
     finally:
         os.unlink(tmp_path)
 
@@ -2003,43 +2469,48 @@ async def upload_pdf(file: UploadFile = File(...)):
             ),
         )
 
-    init_db()
-    insert_questions(questions)
+    await run_in_threadpool(_replace_questions, questions)
 
     return JSONResponse({"count": len(questions), "redirect": "/test"})
 
 
 @app.get("/api/questions")
-async def get_all_questions():
-    with get_connection() as conn:
-        rows = conn.execute(
-            "SELECT id, question, option_a, option_b, option_c, option_d, "
-            "option_a_image, option_b_image, option_c_image, option_d_image, "
-            "has_diagram, image_path, question_image FROM questions ORDER BY id"
-        ).fetchall()
-    return [dict(r) for r in rows]
+def get_all_questions(request: Request):
+    snap = _questions_snapshot()
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _accepts_gzip(request.headers.get("accept-encoding")):
+        etag, body = snap.gz_etag, snap.gz_body
+        headers["Content-Encoding"] = "gzip"
+    else:
+        etag, body = snap.etag, snap.body
+    headers["ETag"] = etag
+    # Either tag names the same question set, so both revalidate.
+    if _etag_matches(request.headers.get("if-none-match"), snap.etag, snap.gz_etag):
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
 
 # ──────────────────────────────────────────────
 # Admin helpers and routes
 # ──────────────────────────────────────────────
 
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
+def require_admin(current_user: AuthUser = Depends(get_current_user)) -> dict:
     """FastAPI dependency: raises HTTP 403 unless the user has is_admin = 1."""
-    user = db_get_user_by_id(current_user["user_id"])
+    user = db_get_user_by_id(current_user.user_id)
     if not user or not user.get("is_admin"):
         raise HTTPException(status_code=403, detail="Admin access required.")
     return user
 
 
 @app.post("/api/admin/question/{question_id}/answer")
-async def api_set_question_answer(
+def api_set_question_answer(
     question_id: int,
     body: SetAnswerRequest,
     admin: dict = Depends(require_admin),
 ):
     """Admin only: set the correct answer for a question."""
-    if body.correct_option not in ("a", "b", "c", "d"):
+    if body.correct_option not in _VALID_KEYS:
         raise HTTPException(
             status_code=400, detail="correct_option must be one of: a, b, c, d."
         )
@@ -2050,13 +2521,13 @@ async def api_set_question_answer(
 
 
 @app.get("/api/admin/config")
-async def api_get_scoring_config(admin: dict = Depends(require_admin)):
+def api_get_scoring_config(admin: dict = Depends(require_admin)):
     """Admin only: retrieve current scoring configuration."""
     return db_get_scoring_config()
 
 
 @app.post("/api/admin/config")
-async def api_update_scoring_config(
+def api_update_scoring_config(
     body: ScoringConfigRequest,
     admin: dict = Depends(require_admin),
 ):
@@ -0,0 +1,359 @@
+"""
+pdf_extract.py – per-page text and image extraction for uploaded PDFs
+
+Kept apart from main.py so the spawn-started page workers only import
+pdfplumber and this module – not auth, the FastAPI app or the database.
+"""
+
+import bisect
+import operator
+import os
+import uuid
+from dataclasses import dataclass
+
+import pdfplumber
+
+# Same directory main.py serves as /static/images.
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "images")
+
+
+# ── Math character normalization ──────────────────────────────────────────────
+# Some PDFs (especially Indian exam PDFs) use Symbol or custom math fonts where
+# glyph codes don't match the expected Unicode codepoints.  This table maps the
+# most common problematic encodings to their correct Unicode equivalents.
+_MATH_CHAR_MAP: dict[str, str] = {
+    "\uf028": "√",   # radical sign in some Symbol-variant fonts
+    "\uf0d6": "√",   # alternative radical encoding
+    "\uf0b0": "°",   # degree in Symbol font
+    "\uf0b2": "²",   # superscript 2 in some fonts
+    "\uf0b3": "³",   # superscript 3
+    "\uf02d": "−",   # minus in Symbol font
+    "\u221a": "√",   # U+221A – already correct, normalise to same char
+    "\u2212": "−",   # U+2212 minus – already correct
+}
+_MATH_TRANS = str.maketrans(_MATH_CHAR_MAP)
+assert not any(c.isascii() for c in _MATH_CHAR_MAP)  # relied on by _normalize_math_chars
+
+
+def _normalize_math_chars(text: str) -> str:
+    """Map known symbol-font mis-encodings to correct Unicode math characters."""
+    # Every mapped char is non-ASCII, and str.isascii() is O(1) for CPython's
+    # compact ASCII strings, so the common all-ASCII line returns as-is
+    # without translate() allocating a copy.
+    if text.isascii():
+        return text
+    return text.translate(_MATH_TRANS)
+
+
+# ──────────────────────────────────────────────
+# Text extraction: extract_text() + chars for Y-coordinates
+# ──────────────────────────────────────────────
+# Many JEE/NEET PDFs encode individual characters as separate glyphs with
+# wide inter-character spacing.  pdfplumber's extract_words() treats each
+# char as a separate "word" regardless of x_tolerance.
+#
+# However, extract_text() uses pdfplumber's internal layout engine which
+# correctly reconstructs words with proper spacing.  So we:
+#   1. Use extract_text() to get properly-spaced text lines.
+#   2. Use page.chars to build a Y-coordinate lookup for each line.
+#   3. Combine them into the same visual-line dicts the parser expects.
+# ──────────────────────────────────────────────
+
+# Tolerance for matching chars to a text line's Y-coordinate.
+LINE_Y_TOL = 5.0
+
+
+# Field order of the per-char tuples built by _extract_text_lines.
+_CH_TOP, _CH_X0, _CH_X1, _CH_SIZE, _CH_BOTTOM, _CH_TEXT = range(6)
+_TOP_X0_KEY = operator.itemgetter(_CH_TOP, _CH_X0)
+_X0_KEY     = operator.itemgetter(_CH_X0)
+
+
+@dataclass(slots=True)
+class VLine:
+    """One visual line: its text, vertical extent and left edge (PDF points)."""
+    text:   str
+    top:    float
+    bottom: float
+    x0:     float
+
+
+# Digit → superscript / subscript digit, for rows merged into the line above.
+_SUP_MAP = str.maketrans("0123456789", "⁰¹²³⁴⁵⁶⁷⁸⁹")
+_SUB_MAP = str.maketrans("0123456789", "₀₁₂₃₄₅₆₇₈₉")
+
+
+def _extract_text_lines(page) -> list[VLine]:
+    """
+    Build visual lines directly from raw character data.
+
+    Groups chars by Y-position (LINE_Y_TOL tolerance), reconstructs text
+    by inserting spaces where there is a horizontal gap between chars, and
+    merges subscript/superscript rows (avg font-size < 80% of dominant)
+    into the preceding line.
+
+    This approach avoids the index-alignment bug that occurred when pairing
+    extract_text() lines with y_rows derived from chars — pdfplumber's
+    extract_text() folds subscripts inline while the char data keeps them on
+    separate Y-rows, causing a one-off mismatch for every subscript line.
+
+    Returns VLines sorted by vertical position.
+    """
+    chars = page.chars or []
+    if not chars:
+        return []
+
+    # Coerce each char dict once into a flat tuple (see _CH_* indices) so the
+    # sort, grouping and text-assembly loops below work on plain floats
+    # instead of repeated dict.get + float() calls per char.
+    recs = [
+        (
+            float(c["top"]),
+            float(c.get("x0", 0)),
+            float(c["x1"]) if "x1" in c else None,
+            float(c.get("size", 0)),
+            float(c.get("bottom", c["top"] + 12)),
+            c.get("text", ""),
+        )
+        for c in chars
+    ]
+
+    # Sort chars by top Y then x0 (stable: exact ties keep page order)
+    recs.sort(key=_TOP_X0_KEY)
+    tops = [r[_CH_TOP] for r in recs]
+
+    # Group into Y-rows by top tolerance: a row is every char within
+    # LINE_Y_TOL below the row's first char.  tops is sorted, so each row end
+    # is found with a C-level bisect instead of visiting every char.
+    rows: list[list] = []
+    n = len(tops)
+    start = 0
+    while start < n:
+        anchor = tops[start]
+        end = bisect.bisect_right(tops, anchor + LINE_Y_TOL, start + 1)
+        # Settle float rounding at the boundary to the exact
+        # `top - anchor <= LINE_Y_TOL` test.
+        while end < n and tops[end] - anchor <= LINE_Y_TOL:
+            end += 1
+        while end > start + 1 and tops[end - 1] - anchor > LINE_Y_TOL:
+            end -= 1
+        rows.append(recs[start:end])
+        start = end
+
+    # Dominant font size (median across all chars)
+    all_sizes = sorted(r[_CH_SIZE] for r in recs if r[_CH_SIZE] > 0)
+    dominant_size = all_sizes[len(all_sizes) // 2] if all_sizes else 12.0
+
+    result: list[VLine] = []
+    for row in rows:
+        row_sorted = sorted(row, key=_X0_KEY)
+
+        # Reconstruct text, inserting a space wherever char gap > 25% of font size.
+        # The same pass accumulates the row's top/bottom/size sums, so every
+        # char is visited once rather than once per statistic.
+        text_parts: list[str] = []
+        # Sentinel instead of None: the first char always "has a gap", and the
+        # leading space that adds is removed by the strip() below.
+        prev_x1 = -1e30
+        sum_top = sum_bot = sum_size = 0.0
+        n_sized = 0
+        for top, x0, x1, sz, bot, ch in row_sorted:
+            sum_top += top
+            sum_bot += bot
+            if sz > 0:
+                sum_size += sz
+                n_sized += 1
+            if not ch:
+                continue
+            sz = sz or dominant_size
+            if x1 is None:
+                x1 = x0 + sz * 0.5
+            if x0 - prev_x1 > sz * 0.25:
+                text_parts.append(" ")
+            text_parts.append(ch)
+            if x1 > prev_x1:
+                prev_x1 = x1
+
+        text = "".join(text_parts).strip()
+        if not text:
+            continue
+
+        # Normalise symbol-font mis-encodings (e.g. \uf028 → √)
+        text = _normalize_math_chars(text)
+
+        avg_top  = sum_top / len(row)
+        avg_bot  = sum_bot / len(row)
+        min_x0   = row_sorted[0][_CH_X0]
+        avg_size = sum_size / n_sized if n_sized else 0.0
+
+        is_sub = avg_size > 0 and avg_size < dominant_size * 0.80
+
+        if is_sub and result:
+            prev = result[-1]
+            prev_center = (prev.top + prev.bottom) / 2.0
+            row_center  = avg_top + (avg_bot - avg_top) / 2.0
+            # Row center above previous line center → superscript; else subscript
+            if row_center < prev_center:
+                text = text.translate(_SUP_MAP)
+            else:
+                text = text.translate(_SUB_MAP)
+            prev.text += text
+            prev.bottom = max(prev.bottom, avg_bot)
+        else:
+            result.append(VLine(text, avg_top, avg_bot, min_x0))
+
+    return result
+
+
+# ──────────────────────────────────────────────
+# Image extraction helpers
+# ──────────────────────────────────────────────
+
+# zlib effort for every PNG written under static/images/.  Level 1 encodes
+# several times faster than Pillow's default (6) for ~10% larger files – the
+# 150 dpi renders are large and deflate dominates their save time.
+PNG_COMPRESS_LEVEL = 1
+
+
+def _save_page_images(page, page_num: int) -> list[dict]:
+    """
+    Extract diagrams from a pdfplumber page.
+
+    Two sources are tried:
+      1. page.images  – embedded raster images (JPEG/PNG streams inside the PDF).
+      2. page.figures – bounding boxes of vector-graphic regions (lines, curves,
+                        fills drawn with PDF path operators).  This captures
+                        diagrams that were drawn rather than embedded, including
+                        diagrams that span two pages (each half is captured
+                        separately and both halves attach to the same question
+                        via the y_offset coordinate system in the caller).
+
+    Saves each region as PNG under static/images/.
+    Returns list of dicts: [{"path": web_path, "top": y_top, "bottom": y_bot}, …]
+    """
+    saved: list[dict] = []
+    MIN_DIM = 40.0   # PDF points (~56 px at 96 dpi); ignore tiny decorative elements
+
+    try:
+        from PIL import Image as _PILImage  # type: ignore  # noqa: PLC0415, F841
+    except ImportError:
+        print("[WARN] Pillow not installed – image extraction skipped.")
+        return saved
+
+    # ── 1. Embedded raster images ────────────────────────────────────────────
+    for idx, img_meta in enumerate(page.images or []):
+        try:
+            x0 = float(img_meta.get("x0", 0))
+            y0 = float(img_meta.get("top", img_meta.get("y0", 0)))
+            x1 = float(img_meta.get("x1", page.width))
+            y1 = float(img_meta.get("bottom", img_meta.get("y1", page.height)))
+
+            # pdfplumber's page.images uses top-origin coords (top < bottom).
+            top    = min(y0, y1)
+            bottom = max(y0, y1)
+            if top >= bottom or x0 >= x1:
+                continue
+
+            # Skip tiny decorative images (logos, favicons, footer strips)
+            if (x1 - x0) < MIN_DIM or (bottom - top) < MIN_DIM:
+                continue
+
+            cropped = page.crop((x0, top, x1, bottom))
+            pil_img = cropped.to_image(resolution=150).original
+
+            fname    = f"page{page_num}_img{idx}_{uuid.uuid4().hex[:6]}.png"
+            out_path = os.path.join(IMAGES_DIR, fname)
+            pil_img.save(out_path, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+            saved.append({"path": f"/static/images/{fname}", "top": top, "bottom": bottom})
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] Could not extract image on page {page_num} idx {idx}: {exc}")
+
+    # ── 2. Vector/drawn figures via page.figures ─────────────────────────────
+    # page.figures groups all path-based graphical objects (rects, lines, curves)
+    # into bounding-box regions.  This captures diagrams that are drawn rather
+    # than embedded, including those that span two pages.
+    for idx2, fig in enumerate(getattr(page, "figures", None) or []):
+        try:
+            fx0     = float(fig.get("x0", 0))
+            ftop    = float(fig.get("top", 0))
+            fx1     = float(fig.get("x1", page.width))
+            fbottom = float(fig.get("bottom", page.height))
+
+            if (fx1 - fx0) < MIN_DIM or (fbottom - ftop) < MIN_DIM:
+                continue
+
+            # Skip if a raster image already covers approximately the same region
+            fig_center_y = (ftop + fbottom) / 2.0
+            already_covered = any(
+                abs(((r["top"] + r["bottom"]) / 2.0) - fig_center_y) < 30
+                for r in saved
+            )
+            if already_covered:
+                continue
+
+            cropped = page.crop((fx0, ftop, fx1, fbottom))
+            pil_img = cropped.to_image(resolution=150).original
+
+            fname    = f"page{page_num}_fig{idx2}_{uuid.uuid4().hex[:6]}.png"
+            out_path = os.path.join(IMAGES_DIR, fname)
+            pil_img.save(out_path, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+            saved.append({"path": f"/static/images/{fname}", "top": ftop, "bottom": fbottom})
+        except Exception as exc:  # noqa: BLE001
+            print(f"[WARN] Could not render figure on page {page_num} idx2 {idx2}: {exc}")
+
+    return saved
+
+
+# ──────────────────────────────────────────────
+# Per-page entry points (in-process or in a page worker)
+# ──────────────────────────────────────────────
+
+def extract_page(page, page_num: int) -> tuple[list[VLine], list[dict]]:
+    """Visual lines and saved images of one page, in page-local coordinates."""
+    page_lines: list[VLine] = []
+    page_imgs: list[dict] = []
+    try:
+        page_lines = _extract_text_lines(page)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[WARN] Skipping text on page {page_num}: {exc}")
+
+    try:
+        page_imgs = _save_page_images(page, page_num)
+    except Exception as exc:  # noqa: BLE001
+        print(f"[WARN] Image extraction failed on page {page_num}: {exc}")
+
+    # Text and images are all extracted from this page, so drop pdfplumber's
+    # cached layout / char objects now.  Otherwise every page's parsed objects
+    # stay alive until the PDF is closed and peak memory grows with the whole
+    # document.  The screenshot pass only renders page regions and does not
+    # need them.
+    page.flush_cache()
+    return page_lines, page_imgs
+
+
+def extract_page_range(pdf_path: str, first: int, last: int) -> list[tuple]:
+    """Worker entry point: extract_page for pages first..last (1-based, inclusive).
+
+    If the block fails part-way, the images already saved for it are deleted
+    before re-raising: the caller re-extracts the whole block and would never
+    learn their file names.
+    """
+    done: list[tuple] = []
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            for n in range(first, last + 1):
+                done.append(extract_page(pdf.pages[n - 1], n))
+    except BaseException:
+        remove_page_images(done)
+        raise
+    return done
+
+
+def remove_page_images(extracted: list[tuple]) -> None:
+    """Delete the image files referenced by extract_page results."""
+    for _, page_imgs in extracted:
+        for img in page_imgs:
+            try:
+                os.remove(os.path.join(IMAGES_DIR, os.path.basename(img["path"])))
+            except OSError:
+                pass